@@ -1,12 +1,33 @@
 import logging
+from typing import List, Optional
+
 import paho.mqtt.client as mqtt
+from pydantic import TypeAdapter
 from app.interfaces.agent_gateway import AgentGateway
 from app.entities.agent_data import AgentData, GpsData
-from app.usecases.data_processing import process_agent_data
+from app.usecases.data_processing import (
+    VehicleStates,
+    process_agent_data,
+    process_agent_data_batch,
+    vehicle_states,
+)
 from app.interfaces.hub_gateway import HubGateway
 
 
+agent_data_list = TypeAdapter(List[AgentData])
+
+
 class AgentMQTTAdapter(AgentGateway):
+    """
+    Receives agent data, classifies it and sends it to the hub.
+    Several worker processes can split the agent topic:
+    - with `shared_group` they join an MQTT shared subscription and the broker
+      hands every message to one of them;
+    - with `worker_count` > 1 every worker receives all the messages and keeps
+      the vehicles whose user id modulo `worker_count` is `worker_index`, so
+      the classifier state of a vehicle stays in one process.
+    """
+
     def __init__(
         self,
         broker_host,
@@ -14,8 +35,18 @@ class AgentMQTTAdapter(AgentGateway):
         topic,
         hub_gateway: HubGateway,
         batch_size=10,
+        states: VehicleStates = vehicle_states,
+        shared_group: Optional[str] = None,
+        worker_index: int = 0,
+        worker_count: int = 1,
     ):
         self.batch_size = batch_size
+        # Classifier state of every vehicle
+        self.states = states
+        # Workers splitting the messages
+        self.shared_group = shared_group
+        self.worker_index = worker_index
+        self.worker_count = worker_count
         # MQTT
         self.broker_host = broker_host
         self.broker_port = broker_port
@@ -27,7 +58,10 @@ class AgentMQTTAdapter(AgentGateway):
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             logging.info("Connected to MQTT broker")
-            self.client.subscribe(self.topic)
+            if self.shared_group:
+                self.client.subscribe(f"$share/{self.shared_group}/{self.topic}")
+            else:
+                self.client.subscribe(self.topic)
         else:
             logging.info(f"Failed to connect to MQTT broker with code: {rc}")
 
@@ -35,16 +69,33 @@ class AgentMQTTAdapter(AgentGateway):
         """Processing agent data and sent it to hub gateway"""
         try:
             payload: str = msg.payload.decode("utf-8")
+            # A JSON array carries a batch of samples, classified at once
+            if payload.lstrip().startswith("["):
+                agent_data_batch = agent_data_list.validate_json(payload, strict=True)
+                if self.worker_count > 1:
+                    agent_data_batch = [
+                        agent_data for agent_data in agent_data_batch if self.owns(agent_data)
+                    ]
+                processed_data_batch = process_agent_data_batch(agent_data_batch, self.states)
+                if not self.hub_gateway.save_data_batch(processed_data_batch):
+                    logging.error("Hub is not available")
+                return
             # Create AgentData instance with the received data
             agent_data = AgentData.model_validate_json(payload, strict=True)
+            if not self.owns(agent_data):
+                return
             # Process the received data (you can call a use case here if needed)
-            processed_data = process_agent_data(agent_data)
+            processed_data = process_agent_data(agent_data, self.states)
             # Store the agent_data in the database (you can send it to the data processing module)
             if not self.hub_gateway.save_data(processed_data):
                 logging.error("Hub is not available")
         except Exception as e:
             logging.info(f"Error processing MQTT message: {e}")
 
+    def owns(self, agent_data: AgentData) -> bool:
+        """Whether this worker processes the vehicle of the agent data"""
+        return (agent_data.user_id or 0) % self.worker_count == self.worker_index
+
     def connect(self):
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
@@ -54,6 +105,7 @@ class AgentMQTTAdapter(AgentGateway):
         self.client.loop_start()
 
     def stop(self):
+        self.client.disconnect()
         self.client.loop_stop()
 
 
@@ -1,14 +1,65 @@
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 
 import requests as requests
+from requests.adapters import HTTPAdapter
 
 from app.entities.processed_agent_data import ProcessedAgentData
 from app.interfaces.hub_gateway import HubGateway
+from app.usecases.batching import BatchPublisher
+
+# Hub responses worth sending the batch again for
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
 
 
 class HubHttpAdapter(HubGateway):
-    def __init__(self, api_base_url):
+    """
+    Sends processed agent data to the hub bulk endpoint.
+    Records are collected in batches of up to batch_size, sent at the latest
+    batch_linger_ms after the first record of the batch was queued. Batches are
+    posted by `concurrency` threads over keep-alive connections; when
+    2 × concurrency batches are in flight, callers wait for one to finish,
+    at most `timeout` seconds, before the batch is dropped.
+    A batch the hub does not take (connection error, timeout, 408, 429 or
+    5xx) is posted again up to `retries` times with exponential backoff
+    before it is dropped. While the last batch failed, saving returns False
+    so the caller knows the hub is not available.
+    """
+
+    def __init__(
+        self,
+        api_base_url,
+        batch_size=50,
+        batch_linger_ms=100,
+        concurrency=4,
+        timeout=10,
+        retries=3,
+        retry_delay=0.5,
+    ):
         self.api_base_url = api_base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        # Batches dropped after their last attempt failed
+        self.failed_batches = 0
+        self._hub_failing = False
+        self._lock = threading.Lock()
+        # Keep-alive connections shared by the sending threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="hub-http")
+        self._in_flight = threading.BoundedSemaphore(concurrency * 2)
+        self.publisher = BatchPublisher(
+            publish=self._submit_batch,
+            max_records=batch_size,
+            linger_ms=batch_linger_ms,
+            name="hub-http-publisher",
+        )
 
     def save_data(self, processed_data: ProcessedAgentData):
         """
@@ -16,14 +67,70 @@ class HubHttpAdapter(HubGateway):
         Parameters:
             processed_data (ProcessedAgentData): Processed road data to be saved.
         Returns:
-            bool: True if the data is successfully saved, False otherwise.
+            bool: True if the data is queued and the hub took the last batch, False otherwise.
         """
-        url = f"{self.api_base_url}/processed_agent_data/"
+        return self.save_data_batch([processed_data])
+
+    def save_data_batch(self, processed_data_batch: List[ProcessedAgentData]):
+        queued = self.publisher.add(processed_data_batch)
+        return queued and not self._hub_failing
+
+    def stop(self):
+        self.publisher.close()
+        self.executor.shutdown(wait=True)
+        self.session.close()
 
-        response = requests.post(url, data=processed_data.model_dump_json())
-        if response.status_code != 200:
-            logging.info(
-                f"Invalid Hub response\nData: {processed_data.model_dump_json()}\nResponse: {response}"
-            )
+    def _submit_batch(self, processed_data_batch: List[ProcessedAgentData]) -> bool:
+        if not self._in_flight.acquire(timeout=self.timeout):
+            logging.error(f"Too many requests to the Hub in flight, dropping {len(processed_data_batch)} items")
+            self._record_result(False)
             return False
+        try:
+            future = self.executor.submit(self._send_batch, processed_data_batch)
+        except RuntimeError as e:  # the executor is shut down
+            self._in_flight.release()
+            logging.error(f"Error sending {len(processed_data_batch)} items to the Hub: {e}")
+            self._record_result(False)
+            return False
+        future.add_done_callback(lambda _: self._in_flight.release())
         return True
+
+    def _send_batch(self, processed_data_batch: List[ProcessedAgentData]) -> bool:
+        """Post a batch, retrying the failures worth it; returns whether the hub took it"""
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            sent, retryable = self._post_batch(processed_data_batch)
+            if sent or not retryable:
+                break
+        if not sent:
+            logging.error(f"Dropping {len(processed_data_batch)} items the Hub did not take")
+        self._record_result(sent)
+        return sent
+
+    def _post_batch(self, processed_data_batch: List[ProcessedAgentData]):
+        """Post a batch once; returns whether it was sent and, if not, whether to retry"""
+        url = f"{self.api_base_url}/processed_agent_data/bulk"
+        json_strings = [processed_data.model_dump_json() for processed_data in processed_data_batch]
+        data = f'[{",".join(json_strings)}]'
+        headers = {"Content-Type": "application/json"}
+        try:
+            with self.session.post(url, data=data, headers=headers, timeout=self.timeout) as response:
+                if response.status_code != 200:
+                    logging.info(
+                        f"Invalid Hub response for {len(processed_data_batch)} items\nResponse: {response}"
+                    )
+                    return False, response.status_code in RETRYABLE_STATUS_CODES
+                rejected = response.json().get("rejected", 0)
+                if rejected:
+                    logging.info(f"Hub rejected {rejected} of {len(processed_data_batch)} items: {response.text}")
+        except Exception as e:
+            logging.error(f"Error sending {len(processed_data_batch)} items to the Hub: {e}")
+            return False, True
+        return True, False
+
+    def _record_result(self, sent: bool):
+        with self._lock:
+            self._hub_failing = not sent
+            if not sent:
+                self.failed_batches += 1
@@ -1,18 +1,35 @@
 import logging
+from typing import List
 
 import requests as requests
 from paho.mqtt import client as mqtt_client
 
 from app.entities.processed_agent_data import ProcessedAgentData
 from app.interfaces.hub_gateway import HubGateway
+from app.usecases.batching import BatchPublisher
 
 
 class HubMqttAdapter(HubGateway):
-    def __init__(self, broker, port, topic):
+    """
+    Publishes processed agent data to the hub topic.
+    With batch_size > 1 the data is published as JSON arrays of up to
+    batch_size records, flushed at the latest batch_linger_ms after the
+    first record of the batch was queued.
+    """
+
+    def __init__(self, broker, port, topic, batch_size=1, batch_linger_ms=0):
         self.broker = broker
         self.port = port
         self.topic = topic
         self.mqtt_client = self._connect_mqtt(broker, port)
+        self.publisher = None
+        if batch_size > 1:
+            self.publisher = BatchPublisher(
+                publish=self._publish_batch,
+                max_records=batch_size,
+                linger_ms=batch_linger_ms,
+                name="hub-mqtt-publisher",
+            )
 
     def save_data(self, processed_data: ProcessedAgentData):
         """
@@ -22,7 +39,26 @@ class HubMqttAdapter(HubGateway):
         Returns:
             bool: True if the data is successfully saved, False otherwise.
         """
+        if self.publisher is not None:
+            return self.publisher.add([processed_data])
         msg = processed_data.model_dump_json()
+        return self._publish(msg)
+
+    def save_data_batch(self, processed_data_batch: List[ProcessedAgentData]):
+        if self.publisher is not None:
+            return self.publisher.add(processed_data_batch)
+        return super().save_data_batch(processed_data_batch)
+
+    def stop(self):
+        if self.publisher is not None:
+            self.publisher.close()
+        self.mqtt_client.loop_stop()
+
+    def _publish_batch(self, processed_data_batch: List[ProcessedAgentData]) -> bool:
+        json_strings = [processed_data.model_dump_json() for processed_data in processed_data_batch]
+        return self._publish(f'[{",".join(json_strings)}]')
+
+    def _publish(self, msg: str) -> bool:
         result = self.mqtt_client.publish(self.topic, msg)
         status = result[0]
         if status == 0:
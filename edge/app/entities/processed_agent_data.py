@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 from app.entities.agent_data import AgentData
 
@@ -5,3 +7,5 @@ from app.entities.agent_data import AgentData
 class ProcessedAgentData(BaseModel):
     road_state: str
     agent_data: AgentData
+    # Idempotency key: user id and timestamp of the reading, see data_processing.py
+    dedup_key: Optional[str] = None
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from typing import List
 from app.entities.processed_agent_data import ProcessedAgentData
 
 
@@ -18,3 +19,20 @@ class HubGateway(ABC):
             bool: True if the data is successfully saved, False otherwise.
         """
         pass
+
+    def save_data_batch(self, processed_data_batch: List[ProcessedAgentData]) -> bool:
+        """
+        Method to save several processed agent data at once.
+        Adapters able to send a batch in one go override it.
+        Parameters:
+            processed_data_batch (List[ProcessedAgentData]): The processed agent data to be saved.
+        Returns:
+            bool: True if all the data is successfully saved, False otherwise.
+        """
+        return all([self.save_data(processed_data) for processed_data in processed_data_batch])
+
+    def stop(self):
+        """
+        Method to send the data still queued and release the resources of the gateway.
+        """
+        pass
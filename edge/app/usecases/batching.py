@@ -0,0 +1,82 @@
+import logging
+import threading
+import time
+from typing import Callable, List
+
+from app.entities.processed_agent_data import ProcessedAgentData
+
+
+class BatchPublisher:
+    """
+    Collects processed agent data and hands it to `publish` in batches of at
+    most `max_records`. A batch goes out as soon as it is full, from the
+    thread adding the last record, or once its oldest record waited
+    `linger_ms`, from a background thread.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[List[ProcessedAgentData]], bool],
+        max_records: int,
+        linger_ms: int,
+        name: str = "batch-publisher",
+    ):
+        self.publish = publish
+        self.max_records = max_records
+        self.linger_ms = linger_ms
+        self._items: List[ProcessedAgentData] = []
+        self._since = 0.0
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def add(self, items: List[ProcessedAgentData]) -> bool:
+        """
+        Queue items for the next batch, publishing it if it is full.
+        Returns False if publishing a full batch failed.
+        """
+        with self._condition:
+            if not self._items:
+                self._since = time.monotonic()
+                self._condition.notify()
+            self._items.extend(items)
+            if len(self._items) < self.max_records:
+                return True
+            batch = self._take()
+        return self._publish(batch)
+
+    def close(self):
+        """Publish the queued items and stop the background thread"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _take(self) -> List[ProcessedAgentData]:
+        batch, self._items = self._items, []
+        return batch
+
+    def _publish(self, batch: List[ProcessedAgentData]) -> bool:
+        published = True
+        for start in range(0, len(batch), self.max_records):
+            try:
+                published &= bool(self.publish(batch[start:start + self.max_records]))
+            except Exception as e:
+                logging.error(f"Error publishing batch: {e}")
+                published = False
+        return published
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._items and not self._stopped:
+                    self._condition.wait()
+                if not self._items:
+                    return
+                remaining = self._since + self.linger_ms / 1000 - time.monotonic()
+                if remaining > 0 and not self._stopped:
+                    self._condition.wait(remaining)
+                    continue
+                batch = self._take()
+            self._publish(batch)
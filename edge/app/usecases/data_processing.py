@@ -1,23 +1,84 @@
-from collections import deque
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
 from app.entities.agent_data import AgentData
 from app.entities.processed_agent_data import ProcessedAgentData
 
-z_history = deque(maxlen=5)
 THRESHOLD_POTHOLE = 1000
 THRESHOLD_BUMP = 800
+Z_HISTORY_SIZE = 5
+ROAD_STATES = np.array(["normal", "pothole", "bump"])
 
-def process_agent_data(
-    agent_data: AgentData,
-) -> ProcessedAgentData:
+
+class VehicleState:
+    """Classifier state of one vehicle: its last z values"""
+
+    __slots__ = ("z_history", "last_seen")
+
+    def __init__(self):
+        self.z_history = deque(maxlen=Z_HISTORY_SIZE)
+        self.last_seen = 0.0
+
+
+class VehicleStates:
     """
-    Process agent data and classify the state of the road surface.
-    Parameters:
-        agent_data (AgentData): Agent data that containing accelerometer, GPS, and timestamp.
-    Returns:
-        processed_data_batch (ProcessedAgentData): Processed data containing the classified state of the road surface and agent data.
+    Classifier states by user id, bounded in memory.
+    The least recently seen vehicle is evicted above `max_vehicles`, and
+    vehicles not seen for `idle_timeout` seconds are evicted on the next
+    access. An evicted vehicle starts over with an empty state.
+    Readings without a user id share one state.
     """
 
-    z_value = agent_data.accelerometer.z
+    def __init__(self, max_vehicles: int = 10000, idle_timeout: float = 600):
+        self.max_vehicles = max_vehicles
+        self.idle_timeout = idle_timeout
+        self._states: "OrderedDict[Optional[int], VehicleState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def get(self, user_id: Optional[int]) -> VehicleState:
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is None:
+                state = self._states[user_id] = VehicleState()
+            else:
+                self._states.move_to_end(user_id)
+            state.last_seen = now
+            # The least recently seen vehicles are at the front
+            while len(self._states) > self.max_vehicles:
+                self._states.popitem(last=False)
+            while True:
+                oldest = next(iter(self._states.values()))
+                if now - oldest.last_seen < self.idle_timeout:
+                    break
+                self._states.popitem(last=False)
+        return state
+
+
+vehicle_states = VehicleStates()
+
+
+def make_dedup_key(agent_data: AgentData) -> Optional[str]:
+    """
+    Build the idempotency key of a reading from the data the agent sent:
+    user id and timestamp. The same reading processed again (MQTT redelivery,
+    another worker, an edge restart) gets the same key, so the hub and the
+    store keep only one copy. Readings without a user id get no key.
+    """
+    if agent_data.user_id is None:
+        return None
+    return f"{agent_data.user_id}:{agent_data.timestamp.isoformat()}"
+
+
+def classify(z_value: float, z_history: deque) -> str:
+    """Classify the road state from a new z value and update the z history of the vehicle"""
     prev_z = z_history[-1] if z_history else z_value
 
     z_history.append(z_value)
@@ -25,20 +86,121 @@ def process_agent_data(
     z_diff = z_value - prev_z
 
     if z_diff < -THRESHOLD_POTHOLE:
-        road_state = "pothole"
+        return "pothole"
     elif z_diff > THRESHOLD_BUMP and len(z_history) >= 2:
         if z_history[-2] > z_history[-1]:
-            road_state = "bump"
+            return "bump"
         else:
-            road_state = "normal"
+            return "normal"
     else:
-        road_state = "normal"
+        return "normal"
+
+
+def process_agent_data(
+    agent_data: AgentData,
+    states: VehicleStates = vehicle_states,
+) -> ProcessedAgentData:
+    """
+    Process agent data and classify the state of the road surface.
+    Parameters:
+        agent_data (AgentData): Agent data that containing accelerometer, GPS, and timestamp.
+        states (VehicleStates): Classifier states of the vehicles, keyed by user id.
+    Returns:
+        processed_data_batch (ProcessedAgentData): Processed data containing the classified state of the road surface and agent data.
+    """
+
+    state = states.get(agent_data.user_id)
+    road_state = classify(agent_data.accelerometer.z, state.z_history)
 
     processed_data = ProcessedAgentData(
         road_state=road_state,
-        agent_data=agent_data
+        agent_data=agent_data,
+        dedup_key=make_dedup_key(agent_data),
     )
 
     return processed_data
 
 
+def classify_batch(
+    user_ids: Sequence[Optional[int]],
+    z_values: np.ndarray,
+    states: VehicleStates = vehicle_states,
+) -> np.ndarray:
+    """
+    Classify a batch of samples, possibly from many vehicles, in arrival order.
+    Gives the same results as calling classify() sample by sample and leaves
+    the vehicle states as it would.
+    Returns the index of the road state of every sample in ROAD_STATES.
+    """
+    count = len(z_values)
+    if count == 0:
+        return np.zeros(0, dtype=np.int8)
+    codes: Dict[Optional[int], int] = {}
+    vehicle_codes = np.fromiter(
+        (codes.setdefault(user_id, len(codes)) for user_id in user_ids), dtype=np.int64, count=count
+    )
+    # Samples of one vehicle next to each other, in arrival order
+    order = np.argsort(vehicle_codes, kind="stable")
+    z = z_values[order]
+    sorted_codes = vehicle_codes[order]
+    starts = np.empty(count, dtype=bool)
+    starts[0] = True
+    np.not_equal(sorted_codes[1:], sorted_codes[:-1], out=starts[1:])
+    start_indexes = np.flatnonzero(starts)
+    end_indexes = np.append(start_indexes[1:], count)
+
+    # Previous z value of every sample: the one before it in its vehicle,
+    # the last one of the vehicle state, or itself for a new vehicle
+    prev = np.empty(count)
+    prev[1:] = z[:-1]
+    has_prev = ~starts
+    user_ids_by_code = list(codes)
+    for code, start, end in zip(sorted_codes[start_indexes], start_indexes, end_indexes):
+        state = states.get(user_ids_by_code[code])
+        if state.z_history:
+            prev[start] = state.z_history[-1]
+            has_prev[start] = True
+        else:
+            prev[start] = z[start]
+        state.z_history.extend(z[max(start, end - Z_HISTORY_SIZE):end].tolist())
+
+    z_diff = z - prev
+    sorted_result = np.zeros(count, dtype=np.int8)
+    # Same rules as classify(): the previous z value is z_history[-2]
+    bump = (z_diff > THRESHOLD_BUMP) & has_prev & (prev > z)
+    sorted_result[bump] = 2
+    sorted_result[z_diff < -THRESHOLD_POTHOLE] = 1
+
+    result = np.empty(count, dtype=np.int8)
+    result[order] = sorted_result
+    return result
+
+
+def process_agent_data_batch(
+    agent_data_batch: List[AgentData],
+    states: VehicleStates = vehicle_states,
+) -> List[ProcessedAgentData]:
+    """
+    Process a batch of agent data, possibly from many vehicles, with the same
+    results as process_agent_data() applied to every item in order.
+    Parameters:
+        agent_data_batch (List[AgentData]): Agent data in arrival order.
+        states (VehicleStates): Classifier states of the vehicles, keyed by user id.
+    Returns:
+        List[ProcessedAgentData]: Processed data in the order of the batch.
+    """
+    user_ids = [agent_data.user_id for agent_data in agent_data_batch]
+    z_values = np.fromiter(
+        (agent_data.accelerometer.z for agent_data in agent_data_batch),
+        dtype=np.float64,
+        count=len(agent_data_batch),
+    )
+    road_states = ROAD_STATES[classify_batch(user_ids, z_values, states)]
+    return [
+        ProcessedAgentData(
+            road_state=str(road_state),
+            agent_data=agent_data,
+            dedup_key=make_dedup_key(agent_data),
+        )
+        for road_state, agent_data in zip(road_states, agent_data_batch)
+    ]
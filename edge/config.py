@@ -13,12 +13,37 @@ MQTT_BROKER_HOST = os.environ.get("MQTT_BROKER_HOST") or "localhost"
 MQTT_BROKER_PORT = try_parse_int(os.environ.get("MQTT_BROKER_PORT")) or 1883
 MQTT_TOPIC = os.environ.get("MQTT_TOPIC") or "agent_data_topic"
 
+# Classifier state is kept for at most this many vehicles, and dropped after this many idle seconds
+EDGE_MAX_VEHICLES = try_parse_int(os.environ.get("EDGE_MAX_VEHICLES")) or 10000
+EDGE_VEHICLE_IDLE_TIMEOUT = try_parse_int(os.environ.get("EDGE_VEHICLE_IDLE_TIMEOUT")) or 600
+
+# Worker processes consuming the agent topic and how messages are split between them:
+# "shared" through an MQTT shared subscription (every message is parsed by one
+# worker, a vehicle may move between workers) or "hash" by user id (every worker
+# receives and parses all messages and keeps its vehicles' classifier state)
+EDGE_WORKERS = try_parse_int(os.environ.get("EDGE_WORKERS")) or 1
+EDGE_WORKER_DISPATCH = os.environ.get("EDGE_WORKER_DISPATCH") or "shared"
+EDGE_SHARED_GROUP = os.environ.get("EDGE_SHARED_GROUP") or "edge"
+
 # Configuration for hub MQTT
 HUB_MQTT_BROKER_HOST = os.environ.get("HUB_MQTT_BROKER_HOST") or "localhost"
 HUB_MQTT_BROKER_PORT = try_parse_int(os.environ.get("HUB_MQTT_BROKER_PORT")) or 1883
 HUB_MQTT_TOPIC = os.environ.get("HUB_MQTT_TOPIC") or "processed_agent_data_topic"
+# Records are sent to the hub in batches of up to this many records (1 disables batching),
+# a partial batch is sent once its first record waited this long
+HUB_BATCH_SIZE = try_parse_int(os.environ.get("HUB_BATCH_SIZE")) or 50
+HUB_BATCH_LINGER_MS = try_parse_int(os.environ.get("HUB_BATCH_LINGER_MS")) or 100
 
 # Configuration for the Hub
 HUB_HOST = os.environ.get("HUB_HOST") or "localhost"
 HUB_PORT = try_parse_int(os.environ.get("HUB_PORT")) or 8000
 HUB_URL = f"http://{HUB_HOST}:{HUB_PORT}"
+# Transport to the hub: "mqtt" or "http" (batches posted to the hub bulk endpoint)
+HUB_TRANSPORT = os.environ.get("HUB_TRANSPORT") or "mqtt"
+# Concurrent HTTP requests to the hub and their timeout in seconds
+HUB_HTTP_CONCURRENCY = try_parse_int(os.environ.get("HUB_HTTP_CONCURRENCY")) or 4
+HUB_HTTP_TIMEOUT = try_parse_int(os.environ.get("HUB_HTTP_TIMEOUT")) or 10
+# Attempts to post a batch again after a connection error, timeout, 408, 429 or 5xx
+HUB_HTTP_RETRIES = try_parse_int(os.environ.get("HUB_HTTP_RETRIES"))
+if HUB_HTTP_RETRIES is None:
+    HUB_HTTP_RETRIES = 3
@@ -1,51 +1,134 @@
 import logging
+import multiprocessing
+import signal
 from app.adapters.agent_mqtt_adapter import AgentMQTTAdapter
 from app.adapters.hub_http_adapter import HubHttpAdapter
 from app.adapters.hub_mqtt_adapter import HubMqttAdapter
+from app.usecases.data_processing import VehicleStates
 from config import (
     MQTT_BROKER_HOST,
     MQTT_BROKER_PORT,
     MQTT_TOPIC,
+    EDGE_MAX_VEHICLES,
+    EDGE_VEHICLE_IDLE_TIMEOUT,
+    EDGE_WORKERS,
+    EDGE_WORKER_DISPATCH,
+    EDGE_SHARED_GROUP,
     HUB_URL,
+    HUB_TRANSPORT,
+    HUB_HTTP_CONCURRENCY,
+    HUB_HTTP_TIMEOUT,
+    HUB_HTTP_RETRIES,
     HUB_MQTT_BROKER_HOST,
     HUB_MQTT_BROKER_PORT,
     HUB_MQTT_TOPIC,
+    HUB_BATCH_SIZE,
+    HUB_BATCH_LINGER_MS,
 )
 
+SHUTDOWN_SIGNALS = {signal.SIGINT, signal.SIGTERM}
+
+
+def block_shutdown_signals():
+    """
+    Block SIGINT and SIGTERM so they are only taken by wait_for_shutdown().
+    Must be called before starting threads, which inherit the signal mask.
+    """
+    signal.pthread_sigmask(signal.SIG_BLOCK, SHUTDOWN_SIGNALS)
+
+
+def wait_for_shutdown(timeout=None) -> bool:
+    """Sleep until SIGINT or SIGTERM, at most timeout seconds. Returns True on a signal"""
+    if timeout is None:
+        signal.sigwait(SHUTDOWN_SIGNALS)
+        return True
+    return signal.sigtimedwait(SHUTDOWN_SIGNALS, timeout) is not None
+
+
+def run_worker(worker_index=0, worker_count=1):
+    """Classify agent data and forward it to the hub until a shutdown signal"""
+    block_shutdown_signals()
+    # Create an instance of the hub adapter for the configured transport
+    if HUB_TRANSPORT == "http":
+        hub_adapter = HubHttpAdapter(
+            api_base_url=HUB_URL,
+            batch_size=HUB_BATCH_SIZE,
+            batch_linger_ms=HUB_BATCH_LINGER_MS,
+            concurrency=HUB_HTTP_CONCURRENCY,
+            timeout=HUB_HTTP_TIMEOUT,
+            retries=HUB_HTTP_RETRIES,
+        )
+    else:
+        hub_adapter = HubMqttAdapter(
+            broker=HUB_MQTT_BROKER_HOST,
+            port=HUB_MQTT_BROKER_PORT,
+            topic=HUB_MQTT_TOPIC,
+            batch_size=HUB_BATCH_SIZE,
+            batch_linger_ms=HUB_BATCH_LINGER_MS,
+        )
+    shared = worker_count > 1 and EDGE_WORKER_DISPATCH == "shared"
+    # Create an instance of the AgentMQTTAdapter using the configuration
+    agent_adapter = AgentMQTTAdapter(
+        broker_host=MQTT_BROKER_HOST,
+        broker_port=MQTT_BROKER_PORT,
+        topic=MQTT_TOPIC,
+        hub_gateway=hub_adapter,
+        states=VehicleStates(
+            max_vehicles=EDGE_MAX_VEHICLES,
+            idle_timeout=EDGE_VEHICLE_IDLE_TIMEOUT,
+        ),
+        shared_group=EDGE_SHARED_GROUP if shared else None,
+        worker_index=0 if shared else worker_index,
+        worker_count=1 if shared else worker_count,
+    )
+    # Connect to the MQTT broker and start listening for messages
+    agent_adapter.connect()
+    agent_adapter.start()
+    logging.info(f"Worker {worker_index + 1}/{worker_count} started")
+    wait_for_shutdown()
+    # Stop the MQTT adapters and exit gracefully, sending the queued data
+    agent_adapter.stop()
+    hub_adapter.stop()
+    logging.info(f"Worker {worker_index + 1}/{worker_count} stopped")
+
+
+def start_worker(worker_index, worker_count) -> multiprocessing.Process:
+    process = multiprocessing.Process(
+        target=run_worker, args=(worker_index, worker_count), name=f"edge-worker-{worker_index}"
+    )
+    process.start()
+    return process
+
+
+def run_workers(worker_count):
+    """Run the workers in child processes, restart the ones that die, stop them all on a signal"""
+    block_shutdown_signals()
+    workers = [start_worker(index, worker_count) for index in range(worker_count)]
+    while not wait_for_shutdown(timeout=1):
+        for index, worker in enumerate(workers):
+            if not worker.is_alive():
+                logging.error(f"Worker {index + 1}/{worker_count} exited with {worker.exitcode}, restarting it")
+                workers[index] = start_worker(index, worker_count)
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join(timeout=10)
+        if worker.is_alive():
+            worker.kill()
+    logging.info("System stopped.")
+
+
 if __name__ == "__main__":
     # Configure logging settings
     logging.basicConfig(
         level=logging.INFO,  # Set the log level to INFO (you can use logging.DEBUG for more detailed logs)
-        format="[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s",
+        format="[%(asctime)s] [%(levelname)s] [%(processName)s] [%(module)s] %(message)s",
         handlers=[
             logging.StreamHandler(),  # Output log messages to the console
             logging.FileHandler("app.log"),  # Save log messages to a file
         ],
     )
-    # Create an instance of the StoreApiAdapter using the configuration
-    # hub_adapter = HubHttpAdapter(
-    #     api_base_url=HUB_URL,
-    # )
-    hub_adapter = HubMqttAdapter(
-        broker=HUB_MQTT_BROKER_HOST,
-        port=HUB_MQTT_BROKER_PORT,
-        topic=HUB_MQTT_TOPIC,
-    )
-    # Create an instance of the AgentMQTTAdapter using the configuration
-    agent_adapter = AgentMQTTAdapter(
-        broker_host=MQTT_BROKER_HOST,
-        broker_port=MQTT_BROKER_PORT,
-        topic=MQTT_TOPIC,
-        hub_gateway=hub_adapter,
-    )
-    try:
-        # Connect to the MQTT broker and start listening for messages
-        agent_adapter.connect()
-        agent_adapter.start()
-        # Keep the system running indefinitely (you can add other logic as needed)
-        while True:
-            pass
-    except KeyboardInterrupt:
-        # Stop the MQTT adapter and exit gracefully if interrupted by the user
-        agent_adapter.stop()
-        logging.info("System stopped.")
+    if EDGE_WORKERS > 1:
+        run_workers(EDGE_WORKERS)
+    else:
+        run_worker()
@@ -1,21 +1,84 @@
+import gzip
 import json
 import logging
-from typing import List
+from typing import Dict, List, Tuple
 
 import pydantic_core
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import msgpack
+except ImportError:  # the store link falls back to JSON
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # the store link falls back to gzip
+    zstandard = None
 
 from app.entities.processed_agent_data import ProcessedAgentData
-from app.interfaces.store_gateway import StoreGateway
+from app.interfaces.store_gateway import BatchRejectedError, StoreGateway
+
+# Client errors worth sending the batch again for
+RETRYABLE_STATUS_CODES = (408, 429)
 
 
 class StoreApiAdapter(StoreGateway):
-    def __init__(self, api_base_url):
+    def __init__(self, api_base_url, timeout=10, pool_size=10, format="json", encoding="identity"):
         self.api_base_url = api_base_url
+        self.timeout = timeout
+        if format == "msgpack" and msgpack is None:
+            logging.error("msgpack is not installed, sending JSON to the store")
+            format = "json"
+        if encoding == "zstd" and zstandard is None:
+            logging.error("zstandard is not installed, sending gzip to the store")
+            encoding = "gzip"
+        self.format = format
+        self.encoding = encoding
+        # Keep-alive connections shared by all the threads sending batches
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def encode(self, processed_agent_data_batch: List[ProcessedAgentData]) -> Tuple[bytes, Dict[str, str]]:
+        """Encode a batch in the configured transport format and encoding, with the matching headers"""
+        if self.format == "msgpack":
+            # Flat records in the field order the store decodes
+            data = msgpack.packb([
+                (
+                    item.road_state,
+                    item.agent_data.accelerometer.x,
+                    item.agent_data.accelerometer.y,
+                    item.agent_data.accelerometer.z,
+                    item.agent_data.gps.latitude,
+                    item.agent_data.gps.longitude,
+                    item.agent_data.timestamp.isoformat(),
+                    item.dedup_key,
+                )
+                for item in processed_agent_data_batch
+            ])
+            headers = {"Content-Type": "application/msgpack"}
+        else:
+            json_strings = [item.model_dump_json() for item in processed_agent_data_batch]
+            data = f'[{",".join(json_strings)}]'.encode("utf-8")
+            headers = {"Content-Type": "application/json"}
+
+        if self.encoding == "gzip":
+            data = gzip.compress(data, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        elif self.encoding == "zstd":
+            data = zstandard.ZstdCompressor().compress(data)
+            headers["Content-Encoding"] = "zstd"
+        return data, headers
 
     def save_data(self, processed_agent_data_batch: List[ProcessedAgentData]):
         """
         Save the processed road data to the Store API.
+        A store answering 415 does not support the configured transport; the
+        adapter then falls back to plain JSON for this and later batches.
+        Other client errors, but 408 and 429, raise BatchRejectedError.
         Parameters:
             processed_agent_data_batch (dict): Processed road data to be saved.
         Returns:
@@ -23,17 +86,27 @@ class StoreApiAdapter(StoreGateway):
         """
         # Implement it
         url = f"{self.api_base_url}/processed_agent_data/"
-        json_strings = [item.model_dump_json() for item in processed_agent_data_batch]
-        data = f'[{",".join(json_strings)}]'
-
-        headers = {'Content-Type': 'application/json'}
 
         try:
-            with requests.post(url, data=data, headers=headers) as response:
+            data, headers = self.encode(processed_agent_data_batch)
+            with self.session.post(url, data=data, headers=headers, timeout=self.timeout) as response:
+                if response.status_code == 415 and (self.format, self.encoding) != ("json", "identity"):
+                    logging.error(
+                        f"Store does not accept {self.format}/{self.encoding}, falling back to JSON\n"
+                        f"Response: {response.text}"
+                    )
+                    self.format, self.encoding = "json", "identity"
+                    return self.save_data(processed_agent_data_batch)
                 if response.status_code != 200:
-                    logging.error(f"Invalid Hub response\nData: {data}\nResponse: {response}")
+                    logging.error(
+                        f"Invalid Store response for {len(processed_agent_data_batch)} items\nResponse: {response}"
+                    )
+                    if 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_STATUS_CODES:
+                        raise BatchRejectedError(f"{response.status_code} {response.text[:1000]}")
                     return False
+        except BatchRejectedError:
+            raise
         except Exception as e:
             logging.error(f"Error occurred during request: {e}")
             return False
-        return True
\ No newline at end of file
+        return True
@@ -1,4 +1,6 @@
 from datetime import datetime
+from typing import Optional
+
 from pydantic import BaseModel, field_validator
 
 
@@ -17,6 +19,7 @@ class AgentData(BaseModel):
     accelerometer: AccelerometerData
     gps: GpsData
     timestamp: datetime
+    user_id: Optional[int] = None
 
     @classmethod
     @field_validator('timestamp', mode='before')
@@ -0,0 +1,43 @@
+from abc import ABC, abstractmethod
+from typing import List
+from app.entities.processed_agent_data import ProcessedAgentData
+
+
+class BatchQueue(ABC):
+    """
+    Abstract class representing the queue batching processed agent data for the store.
+    All batch queues must implement these methods and expose the `batch_size`,
+    `linger_ms` (both may be tuned at runtime) and `duplicates` attributes.
+    """
+
+    batch_size: int
+    linger_ms: int
+    duplicates: int
+
+    @abstractmethod
+    def add(self, items: List[ProcessedAgentData]):
+        """
+        Method to queue processed agent data.
+        Parameters:
+            items (List[ProcessedAgentData]): The processed agent data to be queued.
+        """
+        pass
+
+    @abstractmethod
+    def backlog(self) -> int:
+        """
+        Method to count the queued items.
+        Returns:
+            int: Number of items waiting for a batch.
+        """
+        pass
+
+    @abstractmethod
+    def start(self):
+        """Start handing out batches in the background"""
+        pass
+
+    @abstractmethod
+    def stop(self):
+        """Stop handing out batches"""
+        pass
@@ -3,6 +3,10 @@ from typing import List
 from app.entities.processed_agent_data import ProcessedAgentData
 
 
+class BatchRejectedError(Exception):
+    """The store refused the batch itself, sending it again cannot succeed"""
+
+
 class StoreGateway(ABC):
     """
     Abstract class representing the Store Gateway interface.
@@ -17,5 +21,7 @@ class StoreGateway(ABC):
             processed_agent_data_batch (ProcessedAgentData): The processed agent data to be saved.
         Returns:
             bool: True if the data is successfully saved, False otherwise.
+        Raises:
+            BatchRejectedError: The store will never accept this batch.
         """
         pass
@@ -0,0 +1,93 @@
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from app.interfaces.batch_queue import BatchQueue
+
+
+class AdaptiveBatchController:
+    """
+    Tunes the batch size and linger time of a batch queue at runtime.
+    Every interval it looks at the store latency (moving average of the
+    observed round trips) and the backlog of the queue:
+    - store slower than the target latency: the batch size shrinks;
+    - backlog of more than one batch with a fast store: the batch size grows,
+      so fewer round trips move the same rows;
+    - the linger time gets what is left of the target latency after the
+      store round trip, so off-peak records are not held longer than needed.
+    Both values stay within the configured bounds.
+    """
+
+    def __init__(
+        self,
+        batcher: BatchQueue,
+        min_batch_size: int,
+        max_batch_size: int,
+        min_linger_ms: int,
+        max_linger_ms: int,
+        target_latency_ms: int,
+        interval_ms: int,
+        smoothing: float = 0.2,
+    ):
+        self.batcher = batcher
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.min_linger_ms = min_linger_ms
+        self.max_linger_ms = max_linger_ms
+        self.target_latency_ms = target_latency_ms
+        self.interval_ms = interval_ms
+        self.smoothing = smoothing
+        self.store_latency_ms: Optional[float] = None
+        self.backlog = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="batch-controller", daemon=True)
+
+    def observe_store_latency(self, seconds: float):
+        """Record the duration of one store round trip"""
+        latency_ms = seconds * 1000
+        with self._lock:
+            if self.store_latency_ms is None:
+                self.store_latency_ms = latency_ms
+            else:
+                self.store_latency_ms += self.smoothing * (latency_ms - self.store_latency_ms)
+
+    def adjust(self):
+        """Recompute the batch size and linger time from the latest observations"""
+        self.backlog = self.batcher.backlog()
+        with self._lock:
+            latency_ms = self.store_latency_ms
+        batch_size = self.batcher.batch_size
+        if latency_ms is not None and latency_ms > self.target_latency_ms:
+            batch_size = int(batch_size * 0.75)
+        elif self.backlog > batch_size:
+            batch_size = int(batch_size * 1.5) + 1
+        self.batcher.batch_size = min(max(batch_size, self.min_batch_size), self.max_batch_size)
+
+        linger_ms = self.target_latency_ms - (latency_ms or 0)
+        self.batcher.linger_ms = int(min(max(linger_ms, self.min_linger_ms), self.max_linger_ms))
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "adaptive": True,
+            "batch_size": self.batcher.batch_size,
+            "linger_ms": self.batcher.linger_ms,
+            "store_latency_ms": self.store_latency_ms,
+            "backlog": self.backlog,
+            "duplicates": self.batcher.duplicates,
+            "target_latency_ms": self.target_latency_ms,
+        }
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval_ms / 1000):
+            try:
+                self.adjust()
+            except Exception as e:
+                logging.error(f"Error adjusting batch size: {e}")
@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from typing import Callable, List, Optional
+
+from redis import Redis
+
+from app.entities.processed_agent_data import ProcessedAgentData
+from app.interfaces.batch_queue import BatchQueue
+from app.usecases.metrics import (
+    BATCHES_FLUSHED,
+    BATCH_SIZE,
+    DUPLICATE_RECORDS_DROPPED,
+    REDIS_FLUSH_SECONDS,
+    REDIS_PUSH_SECONDS,
+)
+
+# Append items to the queue and pop one batch if it is full.
+# Items whose dedup key was seen within the dedup window are skipped.
+# KEYS: queue, timestamp of the oldest queued item
+# ARGV: batch size, now (ms), dedup window (ms, 0 disables it), dedup key prefix,
+#       then a dedup key ('' for none) and an item for every item
+# Returns the number of skipped items and the popped batch.
+PUSH_SCRIPT = """
+local duplicates = 0
+local window = tonumber(ARGV[3])
+for i = 5, #ARGV, 2 do
+    local dedup_key = ARGV[i]
+    if window > 0 and dedup_key ~= '' and
+            not redis.call('SET', ARGV[4] .. dedup_key, 1, 'NX', 'PX', window) then
+        duplicates = duplicates + 1
+    else
+        if redis.call('LLEN', KEYS[1]) == 0 then
+            redis.call('SET', KEYS[2], ARGV[2])
+        end
+        redis.call('RPUSH', KEYS[1], ARGV[i + 1])
+    end
+end
+local batch_size = tonumber(ARGV[1])
+if redis.call('LLEN', KEYS[1]) < batch_size then
+    return {duplicates, {}}
+end
+local batch = redis.call('LRANGE', KEYS[1], 0, batch_size - 1)
+redis.call('LTRIM', KEYS[1], batch_size, -1)
+if redis.call('LLEN', KEYS[1]) == 0 then
+    redis.call('DEL', KEYS[2])
+end
+return {duplicates, batch}
+"""
+
+# Pop one batch if the queue is full or its oldest item waited for the linger time.
+# KEYS: queue, timestamp of the oldest queued item
+# ARGV: batch size, now (ms), linger (ms)
+FLUSH_SCRIPT = """
+local length = redis.call('LLEN', KEYS[1])
+if length == 0 then
+    return {}
+end
+local batch_size = tonumber(ARGV[1])
+local since = tonumber(redis.call('GET', KEYS[2]) or ARGV[2])
+if length < batch_size and tonumber(ARGV[2]) - since < tonumber(ARGV[3]) then
+    return {}
+end
+local batch = redis.call('LRANGE', KEYS[1], 0, batch_size - 1)
+redis.call('LTRIM', KEYS[1], batch_size, -1)
+if redis.call('LLEN', KEYS[1]) == 0 then
+    redis.call('DEL', KEYS[2])
+end
+return batch
+"""
+
+
+class RedisBatcher(BatchQueue):
+    """
+    Collects processed agent data in a Redis list and hands it out in FIFO batches.
+    Pushing and popping a batch is one atomic script call, so several producers
+    (HTTP handlers, the MQTT thread, other hub processes) never split or reorder
+    a batch. A background thread flushes a partial batch once its oldest item
+    waited `linger_ms`.
+    Items carrying a dedup key already seen within `dedup_window_ms` are
+    dropped, so retried publishes are queued once.
+    """
+
+    def __init__(
+        self,
+        redis_client: Redis,
+        key: str,
+        batch_size: int,
+        linger_ms: int,
+        on_batch: Callable[[List[ProcessedAgentData]], None],
+        dedup_window_ms: int = 0,
+        dedup_key_prefix: Optional[str] = None,
+    ):
+        self.redis_client = redis_client
+        self.key = key
+        self.since_key = f"{key}:since"
+        self.batch_size = batch_size
+        self.linger_ms = linger_ms
+        self.on_batch = on_batch
+        self.dedup_window_ms = dedup_window_ms
+        self.dedup_key_prefix = dedup_key_prefix or f"{key}:dedup:"
+        self.duplicates = 0
+        self._push = redis_client.register_script(PUSH_SCRIPT)
+        self._flush = redis_client.register_script(FLUSH_SCRIPT)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="batch-flusher", daemon=True)
+
+    def add(self, items: List[ProcessedAgentData]):
+        """Queue items and hand out a batch if the queue became full"""
+        if not items:
+            return
+        args = [self.batch_size, self._now_ms(), self.dedup_window_ms, self.dedup_key_prefix]
+        for item in items:
+            args.extend((item.dedup_key or "", item.model_dump_json()))
+        started = time.perf_counter()
+        duplicates, batch = self._push(keys=[self.key, self.since_key], args=args)
+        REDIS_PUSH_SECONDS.observe(time.perf_counter() - started)
+        if duplicates:
+            self.duplicates += duplicates
+            DUPLICATE_RECORDS_DROPPED.inc(duplicates)
+            logging.info(f"Skipped {duplicates} duplicate items")
+        self._deliver(batch)
+
+    def flush(self) -> bool:
+        """Hand out one batch if it is full or lingered long enough. Returns True if it did"""
+        started = time.perf_counter()
+        batch = self._flush(
+            keys=[self.key, self.since_key],
+            args=[self.batch_size, self._now_ms(), self.linger_ms],
+        )
+        REDIS_FLUSH_SECONDS.observe(time.perf_counter() - started)
+        self._deliver(batch)
+        return bool(batch)
+
+    def backlog(self) -> int:
+        """Number of items waiting in the queue"""
+        return self.redis_client.llen(self.key)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        # The linger time may be tuned at runtime, so the interval follows it
+        while not self._stopped.wait(max(self.linger_ms / 4, 10) / 1000):
+            try:
+                while self.flush():
+                    pass
+            except Exception as e:
+                logging.error(f"Error flushing batch: {e}")
+
+    def _deliver(self, batch: List[bytes]):
+        if batch:
+            BATCHES_FLUSHED.inc()
+            BATCH_SIZE.observe(len(batch))
+            self.on_batch([ProcessedAgentData.model_validate_json(item) for item in batch])
+
+    @staticmethod
+    def _now_ms() -> int:
+        return int(time.time() * 1000)
@@ -0,0 +1,68 @@
+import json
+from typing import Any, Dict, List, Tuple
+
+from pydantic import TypeAdapter, ValidationError
+
+from app.entities.processed_agent_data import ProcessedAgentData
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+processed_agent_data_list = TypeAdapter(List[ProcessedAgentData])
+
+BulkErrors = List[Dict[str, Any]]
+
+
+def record_error(index: int, error: ValidationError) -> Dict[str, Any]:
+    return {
+        "index": index,
+        "errors": [
+            {"loc": list(detail["loc"]), "msg": detail["msg"], "type": detail["type"]}
+            for detail in error.errors(include_url=False, include_input=False)
+        ],
+    }
+
+
+def parse_json_array(body: bytes) -> Tuple[List[ProcessedAgentData], BulkErrors]:
+    """
+    Validate a JSON array of records.
+    The whole array is validated in one call; only when it holds invalid
+    records are they validated one by one to keep the valid ones.
+    Raises ValueError if the body is not a JSON array.
+    """
+    try:
+        return processed_agent_data_list.validate_json(body), []
+    except ValidationError:
+        pass
+    try:
+        records = json.loads(body)
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON: {e}")
+    if not isinstance(records, list):
+        raise ValueError("Expected a JSON array of records")
+    items, errors = [], []
+    for index, record in enumerate(records):
+        try:
+            items.append(ProcessedAgentData.model_validate(record))
+        except ValidationError as e:
+            errors.append(record_error(index, e))
+    return items, errors
+
+
+def parse_ndjson(body: bytes) -> Tuple[List[ProcessedAgentData], BulkErrors]:
+    """Validate newline delimited records; the index is the number of the record, blank lines excluded"""
+    items, errors = [], []
+    lines = (line for line in body.splitlines() if line.strip())
+    for index, line in enumerate(lines):
+        try:
+            items.append(ProcessedAgentData.model_validate_json(line))
+        except ValidationError as e:
+            errors.append(record_error(index, e))
+    return items, errors
+
+
+def parse_bulk(body: bytes, content_type: str) -> Tuple[List[ProcessedAgentData], BulkErrors]:
+    """Validate a bulk request body, NDJSON or a JSON array depending on its content type"""
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in NDJSON_MEDIA_TYPES:
+        return parse_ndjson(body)
+    return parse_json_array(body)
@@ -0,0 +1,71 @@
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Tuple
+
+from app.entities.processed_agent_data import ProcessedAgentData
+
+EARTH_RADIUS_M = 6371000
+
+
+def distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Equirectangular approximation of the distance in meters, good for short hops"""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+class NormalReadingSampler:
+    """
+    Thins the "normal" readings of every vehicle, keeping every other road state.
+    A normal reading is kept when at least `interval_ms` passed or the vehicle
+    moved at least `distance_m` since the last reading kept for it, so tracks
+    can still be drawn. A limit of 0 disables it; readings without a user id
+    are all kept. The last kept reading of the `max_vehicles` most recently
+    seen vehicles is remembered.
+    """
+
+    def __init__(self, interval_ms: int, distance_m: float, max_vehicles: int):
+        self.interval_s = interval_ms / 1000
+        self.distance_m = distance_m
+        self.max_vehicles = max_vehicles
+        self._last: "OrderedDict[int, Tuple[datetime, float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def keep(self, item: ProcessedAgentData) -> bool:
+        user_id = item.agent_data.user_id
+        if user_id is None:
+            return True
+        timestamp = item.agent_data.timestamp
+        latitude = item.agent_data.gps.latitude
+        longitude = item.agent_data.gps.longitude
+        with self._lock:
+            last = self._last.get(user_id)
+            keep = (
+                last is None
+                or item.road_state != "normal"
+                or self._far_enough(last, timestamp, latitude, longitude)
+            )
+            if keep:
+                self._last[user_id] = (timestamp, latitude, longitude)
+            self._last.move_to_end(user_id)
+            if len(self._last) > self.max_vehicles:
+                self._last.popitem(last=False)
+        return keep
+
+    def filter(self, items: List[ProcessedAgentData]) -> List[ProcessedAgentData]:
+        return [item for item in items if self.keep(item)]
+
+    def _far_enough(self, last, timestamp: datetime, latitude: float, longitude: float) -> bool:
+        last_timestamp, last_latitude, last_longitude = last
+        if self.interval_s > 0:
+            try:
+                if (timestamp - last_timestamp).total_seconds() >= self.interval_s:
+                    return True
+            except TypeError:  # naive and aware timestamps
+                return True
+        if self.distance_m > 0:
+            if distance_m(last_latitude, last_longitude, latitude, longitude) >= self.distance_m:
+                return True
+        return self.interval_s <= 0 and self.distance_m <= 0
@@ -0,0 +1,102 @@
+import logging
+
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Label children are bound once here, so recording on the hot path is a
+# single lock and add, without looking up labels.
+
+MESSAGES_RECEIVED = Counter(
+    "hub_messages_received", "Records received by the hub", ["source"]
+)
+MQTT_MESSAGES_RECEIVED = MESSAGES_RECEIVED.labels(source="mqtt")
+HTTP_MESSAGES_RECEIVED = MESSAGES_RECEIVED.labels(source="http")
+
+RECORDS_DROPPED = Counter(
+    "hub_records_dropped", "Records the hub did not send to the store", ["reason"]
+)
+INVALID_RECORDS_DROPPED = RECORDS_DROPPED.labels(reason="invalid")
+DUPLICATE_RECORDS_DROPPED = RECORDS_DROPPED.labels(reason="duplicate")
+UNBUFFERED_RECORDS_DROPPED = RECORDS_DROPPED.labels(reason="retry_buffer")
+DOWNSAMPLED_RECORDS_DROPPED = RECORDS_DROPPED.labels(reason="downsampled")
+DEAD_LETTERED_RECORDS_DROPPED = RECORDS_DROPPED.labels(reason="dead_letter")
+
+BATCHES_FLUSHED = Counter("hub_batches_flushed", "Batches handed to the store dispatcher")
+BATCH_SIZE = Histogram(
+    "hub_batch_size",
+    "Records per flushed batch",
+    buckets=(1, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000),
+)
+
+STORE_QUEUE_WAIT_SECONDS = Histogram(
+    "hub_store_queue_wait_seconds",
+    "Time a batch waited for a store worker",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+STORE_REQUEST_SECONDS = Histogram(
+    "hub_store_request_seconds",
+    "Store round trip time per batch",
+    ["outcome"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+STORE_REQUEST_OK_SECONDS = STORE_REQUEST_SECONDS.labels(outcome="ok")
+STORE_REQUEST_ERROR_SECONDS = STORE_REQUEST_SECONDS.labels(outcome="error")
+
+REDIS_OPERATION_SECONDS = Histogram(
+    "hub_redis_operation_seconds",
+    "Time of the Redis calls of the batch queues",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1),
+)
+REDIS_PUSH_SECONDS = REDIS_OPERATION_SECONDS.labels(operation="push")
+REDIS_FLUSH_SECONDS = REDIS_OPERATION_SECONDS.labels(operation="flush")
+REDIS_READ_SECONDS = REDIS_OPERATION_SECONDS.labels(operation="read")
+REDIS_CLAIM_SECONDS = REDIS_OPERATION_SECONDS.labels(operation="claim")
+REDIS_ACK_SECONDS = REDIS_OPERATION_SECONDS.labels(operation="ack")
+
+
+class HubStateCollector:
+    """
+    Reports the current state of the batch queue, the store dispatcher and
+    the retry buffer when the metrics are scraped, so it costs nothing on
+    the hot path.
+    """
+
+    def __init__(self, batcher, store_dispatcher, retry_buffer=None):
+        self.batcher = batcher
+        self.store_dispatcher = store_dispatcher
+        self.retry_buffer = retry_buffer
+
+    def collect(self):
+        yield GaugeMetricFamily(
+            "hub_batch_size_current", "Current batch size", value=self.batcher.batch_size
+        )
+        yield GaugeMetricFamily(
+            "hub_batch_linger_ms", "Current batch linger time", value=self.batcher.linger_ms
+        )
+        yield GaugeMetricFamily(
+            "hub_store_queue_depth",
+            "Batches waiting for a store worker",
+            value=self.store_dispatcher.queue_depth(),
+        )
+        try:
+            yield GaugeMetricFamily(
+                "hub_queue_backlog", "Records waiting in the batch queue", value=self.batcher.backlog()
+            )
+            if self.retry_buffer is not None:
+                stats = self.retry_buffer.stats()
+                yield GaugeMetricFamily(
+                    "hub_retry_batches_pending",
+                    "Batches waiting in the retry buffer",
+                    value=stats.pop("batches_pending"),
+                )
+                for name, value in stats.items():
+                    yield CounterMetricFamily(
+                        f"hub_retry_{name}", f"Retry buffer {name.replace('_', ' ')}", value=value
+                    )
+        except Exception as e:
+            logging.error(f"Error collecting Redis metrics: {e}")
+
+
+def register_state_collector(batcher, store_dispatcher, retry_buffer=None):
+    REGISTRY.register(HubStateCollector(batcher, store_dispatcher, retry_buffer))
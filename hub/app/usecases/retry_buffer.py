@@ -0,0 +1,177 @@
+import json
+import random
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from redis import Redis
+
+from app.entities.processed_agent_data import ProcessedAgentData
+
+# Add an entry and drop the entries buffered first above the cap.
+# KEYS: retry set (scored by due time), insertion set (scored by insertion time)
+# ARGV: due time (ms), insertion time (ms), entry, max entries
+ADD_SCRIPT = """
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3])
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[4])
+if excess > 0 then
+    local evicted = redis.call('ZPOPMIN', KEYS[2], excess)
+    for i = 1, #evicted, 2 do
+        redis.call('ZREM', KEYS[1], evicted[i])
+    end
+    return #evicted / 2
+end
+return 0
+"""
+
+# Pop up to count entries due before the given time, then, if there is room
+# left, entries buffered before the given insertion time whatever their due time.
+# KEYS: retry set, insertion set
+# ARGV: max due time (ms), count, max insertion time (ms, '-inf' for none)
+CLAIM_SCRIPT = """
+local count = tonumber(ARGV[2])
+local entries = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, count)
+if #entries < count then
+    local claimed = {}
+    for _, entry in ipairs(entries) do
+        claimed[entry] = true
+    end
+    local buffered = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', '(' .. ARGV[3], 'LIMIT', 0, count)
+    for _, entry in ipairs(buffered) do
+        if #entries >= count then
+            break
+        end
+        if not claimed[entry] then
+            entries[#entries + 1] = entry
+        end
+    end
+end
+if #entries > 0 then
+    redis.call('ZREM', KEYS[1], unpack(entries))
+    redis.call('ZREM', KEYS[2], unpack(entries))
+end
+return entries
+"""
+
+# Keep a batch in the dead letter list, capped to the newest max entries.
+# KEYS: dead letter list
+# ARGV: entry, max entries
+DEAD_LETTER_SCRIPT = """
+redis.call('LPUSH', KEYS[1], ARGV[1])
+redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+"""
+
+
+class RedisRetryBuffer:
+    """
+    Durable buffer of batches the store did not accept.
+    Batches live in a Redis sorted set scored by the time of their next
+    attempt, which grows exponentially with jitter. The set is capped at
+    max_batches; above it the batches buffered first are dropped.
+    Batches failing max_attempts times, or refused by the store for good,
+    are moved to a dead letter list keeping the last max_dead_letters of them
+    for inspection, instead of being retried.
+    """
+
+    def __init__(
+        self,
+        redis_client: Redis,
+        key: str,
+        max_batches: int,
+        base_delay_ms: int,
+        max_delay_ms: int,
+        max_attempts: int = 10,
+        dead_letter_key: Optional[str] = None,
+        max_dead_letters: int = 1000,
+    ):
+        self.redis_client = redis_client
+        self.key = key
+        self.added_key = f"{key}:added"
+        self.max_batches = max_batches
+        self.base_delay_ms = base_delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.max_attempts = max_attempts
+        self.dead_letter_key = dead_letter_key or f"{key}:dead"
+        self.max_dead_letters = max_dead_letters
+        self._add = redis_client.register_script(ADD_SCRIPT)
+        self._claim = redis_client.register_script(CLAIM_SCRIPT)
+        self._dead_letter = redis_client.register_script(DEAD_LETTER_SCRIPT)
+        self._lock = threading.Lock()
+        self._counters = {
+            "batches_buffered": 0,
+            "batches_replayed": 0,
+            "batches_recovered": 0,
+            "batches_dropped": 0,
+            "batches_dead_lettered": 0,
+        }
+
+    def backoff_ms(self, attempt: int) -> float:
+        """Delay before the given attempt: capped exponential backoff with jitter"""
+        delay = min(self.max_delay_ms, self.base_delay_ms * 2 ** min(attempt, 32))
+        return delay * random.uniform(0.5, 1)
+
+    def add(self, batch: List[ProcessedAgentData], attempt: int):
+        """Buffer a batch for its next attempt"""
+        entry = json.dumps({
+            "id": uuid.uuid4().hex,
+            "attempt": attempt,
+            "batch": [item.model_dump(mode="json") for item in batch],
+        })
+        now = time.time() * 1000
+        dropped = self._add(
+            keys=[self.key, self.added_key],
+            args=[now + self.backoff_ms(attempt), now, entry, self.max_batches],
+        )
+        self._count("batches_buffered")
+        if dropped:
+            self._count("batches_dropped", dropped)
+
+    def dead_letter(self, batch: List[ProcessedAgentData], attempt: int, reason: str):
+        """Keep a batch that will not be retried in the dead letter list"""
+        entry = json.dumps({
+            "id": uuid.uuid4().hex,
+            "attempt": attempt,
+            "reason": reason,
+            "time": time.time(),
+            "batch": [item.model_dump(mode="json") for item in batch],
+        })
+        self._dead_letter(keys=[self.dead_letter_key], args=[entry, self.max_dead_letters])
+        self._count("batches_dead_lettered")
+
+    def claim(
+        self, count: int, buffered_before: Optional[float] = None
+    ) -> List[Tuple[List[ProcessedAgentData], int]]:
+        """
+        Take up to count batches out of the buffer, with their attempt number.
+        Batches due are taken first. With buffered_before (epoch ms), batches
+        buffered before it are also taken regardless of their schedule, which
+        is used to drain the buffer at full speed once the store is back.
+        """
+        max_buffered = buffered_before if buffered_before is not None else "-inf"
+        entries = self._claim(
+            keys=[self.key, self.added_key], args=[time.time() * 1000, count, max_buffered]
+        )
+        claimed = []
+        for entry in entries:
+            data = json.loads(entry)
+            batch = [ProcessedAgentData.model_validate(item) for item in data["batch"]]
+            claimed.append((batch, data["attempt"]))
+        if claimed:
+            self._count("batches_replayed", len(claimed))
+        return claimed
+
+    def mark_recovered(self):
+        """Count a replayed batch accepted by the store"""
+        self._count("batches_recovered")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._counters)
+        stats["batches_pending"] = self.redis_client.zcard(self.key)
+        return stats
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
@@ -0,0 +1,228 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+from app.entities.processed_agent_data import ProcessedAgentData
+from app.interfaces.store_gateway import BatchRejectedError, StoreGateway
+from app.usecases.metrics import (
+    DEAD_LETTERED_RECORDS_DROPPED,
+    STORE_QUEUE_WAIT_SECONDS,
+    STORE_REQUEST_ERROR_SECONDS,
+    STORE_REQUEST_OK_SECONDS,
+    UNBUFFERED_RECORDS_DROPPED,
+)
+from app.usecases.retry_buffer import RedisRetryBuffer
+
+
+class StoreDispatcher:
+    """
+    Sends batches to the store from a pool of worker threads.
+    Producers (the MQTT network thread, HTTP handlers, the batch flusher) only
+    put the batch on a bounded queue, so a slow store does not stall ingestion.
+    Batches the store rejects, or that do not fit in the queue within
+    put_timeout, go to the retry buffer. A replay thread feeds them back into the queue on their
+    backoff schedule. The store counts as down after failure_threshold
+    failures in a row; once it accepts a batch again, the batches buffered
+    before that are sent as fast as the workers can, while batches failing
+    after it keep their schedule, so a batch failing on its own is not
+    resent in a loop. Batches failing max_attempts times (see the retry
+    buffer) or refused by the store for good go to the dead letter list.
+    The duration of every store round trip is passed to on_latency, if set.
+    A batch submitted with on_done has it called once the batch is durable:
+    saved by the store, kept in the retry buffer or in the dead letter list.
+    Otherwise (the batch was dropped, or on_done failed) on_failed is called.
+    """
+
+    def __init__(
+        self,
+        store_gateway: StoreGateway,
+        workers: int,
+        queue_size: int,
+        put_timeout: float,
+        retry_buffer: Optional[RedisRetryBuffer] = None,
+        retry_poll_interval: float = 0.5,
+        on_latency: Optional[Callable[[float], None]] = None,
+        failure_threshold: int = 3,
+    ):
+        self.store_gateway = store_gateway
+        self.put_timeout = put_timeout
+        self.retry_buffer = retry_buffer
+        self.retry_poll_interval = retry_poll_interval
+        self.on_latency = on_latency
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self.failure_threshold = failure_threshold
+        self._health_lock = threading.Lock()
+        self._failures = 0
+        # Epoch ms since when the store accepts batches, None while it is down.
+        # Batches left buffered by a previous run are drained at start
+        self._healthy_since: Optional[float] = time.time() * 1000
+        self._stopped = threading.Event()
+        self._workers = [
+            threading.Thread(target=self._run, name=f"store-sender-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        self._replayer = threading.Thread(target=self._replay, name="store-replayer", daemon=True)
+
+    def submit(
+        self,
+        batch: List[ProcessedAgentData],
+        attempt: int = 0,
+        on_done: Optional[Callable[[], None]] = None,
+        on_failed: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        """
+        Queue a batch for the store. When the queue is full, waits for at
+        most put_timeout seconds (not at all for 0), then moves the batch to
+        the retry buffer.
+        Returns False if the batch was not queued.
+        """
+        item = (batch, attempt, on_done, on_failed, time.monotonic())
+        try:
+            if self.put_timeout > 0:
+                self._queue.put(item, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            logging.error(f"Store queue is full, buffering batch of {len(batch)} items")
+            self._complete(self._buffer(batch, attempt), on_done, on_failed)
+            return False
+
+    def queue_depth(self) -> int:
+        """Number of batches waiting for a worker"""
+        return self._queue.qsize()
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+        if self.retry_buffer is not None:
+            self._replayer.start()
+
+    def stop(self):
+        """Send the queued batches and stop the workers"""
+        self._stopped.set()
+        if self._replayer.is_alive():
+            self._replayer.join()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch, attempt, on_done, on_failed, queued = item
+            started = time.monotonic()
+            STORE_QUEUE_WAIT_SECONDS.observe(started - queued)
+            rejected = None
+            try:
+                saved = self.store_gateway.save_data(processed_agent_data_batch=batch)
+            except BatchRejectedError as e:
+                saved, rejected = False, str(e)
+            except Exception as e:
+                logging.error(f"Error sending batch to store: {e}")
+                saved = False
+            latency = time.monotonic() - started
+            (STORE_REQUEST_OK_SECONDS if saved else STORE_REQUEST_ERROR_SECONDS).observe(latency)
+            if self.on_latency is not None:
+                self.on_latency(latency)
+            if saved:
+                self._store_up()
+                if attempt > 0 and self.retry_buffer is not None:
+                    self.retry_buffer.mark_recovered()
+            elif rejected is not None:
+                logging.error(f"Store refused batch of {len(batch)} items: {rejected}")
+                saved = self._dead_letter(batch, attempt + 1, rejected)
+            else:
+                logging.error(f"Store rejected batch of {len(batch)} items")
+                self._store_failed()
+                if self.retry_buffer is not None and attempt + 1 >= self.retry_buffer.max_attempts:
+                    saved = self._dead_letter(batch, attempt + 1, f"Failed {attempt + 1} times")
+                else:
+                    saved = self._buffer(batch, attempt + 1)
+            self._complete(saved, on_done, on_failed)
+
+    def _replay(self):
+        while not self._stopped.is_set():
+            free = self._queue.maxsize - self._queue.qsize()
+            entries = []
+            if free > 0:
+                try:
+                    entries = self.retry_buffer.claim(
+                        count=min(free, len(self._workers)),
+                        buffered_before=self._healthy_since,
+                    )
+                except Exception as e:
+                    logging.error(f"Error claiming batches from retry buffer: {e}")
+            if not entries:
+                self._stopped.wait(self.retry_poll_interval)
+                continue
+            for batch, attempt in entries:
+                self.submit(batch, attempt)
+
+    @staticmethod
+    def _complete(
+        durable: bool,
+        on_done: Optional[Callable[[], None]],
+        on_failed: Optional[Callable[[], None]],
+    ):
+        """Report to the submitter whether the batch is durable"""
+        if durable and on_done is not None:
+            try:
+                on_done()
+                return
+            except Exception as e:
+                logging.error(f"Error completing batch: {e}")
+        elif durable:
+            return
+        if on_failed is not None:
+            try:
+                on_failed()
+            except Exception as e:
+                logging.error(f"Error reporting failed batch: {e}")
+
+    def _store_up(self):
+        with self._health_lock:
+            self._failures = 0
+            if self._healthy_since is None:
+                self._healthy_since = time.time() * 1000
+                logging.info("Store accepts batches again")
+
+    def _store_failed(self):
+        with self._health_lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold and self._healthy_since is not None:
+                self._healthy_since = None
+                logging.error(f"Store failed {self._failures} batches in a row, retrying on backoff")
+
+    def _dead_letter(self, batch: List[ProcessedAgentData], attempt: int, reason: str) -> bool:
+        """Move a batch to the dead letter list. Returns False if it was dropped"""
+        DEAD_LETTERED_RECORDS_DROPPED.inc(len(batch))
+        if self.retry_buffer is None:
+            logging.error(f"Dropping batch of {len(batch)} items: {reason}")
+            return False
+        try:
+            self.retry_buffer.dead_letter(batch, attempt, reason)
+            logging.error(f"Dead-lettered batch of {len(batch)} items: {reason}")
+            return True
+        except Exception as e:
+            logging.error(f"Error dead-lettering batch of {len(batch)} items, dropping it: {e}")
+            return False
+
+    def _buffer(self, batch: List[ProcessedAgentData], attempt: int) -> bool:
+        """Move a batch to the retry buffer. Returns False if it was dropped"""
+        if self.retry_buffer is None:
+            logging.error(f"Dropping batch of {len(batch)} items")
+            UNBUFFERED_RECORDS_DROPPED.inc(len(batch))
+            return False
+        try:
+            self.retry_buffer.add(batch, attempt)
+            return True
+        except Exception as e:
+            logging.error(f"Error buffering batch of {len(batch)} items, dropping it: {e}")
+            UNBUFFERED_RECORDS_DROPPED.inc(len(batch))
+            return False
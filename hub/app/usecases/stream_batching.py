@@ -0,0 +1,277 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from redis import Redis
+from redis.exceptions import ResponseError
+
+from app.entities.processed_agent_data import ProcessedAgentData
+from app.interfaces.batch_queue import BatchQueue
+from app.usecases.metrics import (
+    BATCHES_FLUSHED,
+    BATCH_SIZE,
+    DUPLICATE_RECORDS_DROPPED,
+    INVALID_RECORDS_DROPPED,
+    REDIS_ACK_SECONDS,
+    REDIS_CLAIM_SECONDS,
+    REDIS_PUSH_SECONDS,
+    REDIS_READ_SECONDS,
+)
+
+# Append items to their shard stream, skipping items whose dedup key was seen
+# within the dedup window.
+# KEYS: shard streams
+# ARGV: dedup window (ms, 0 disables it), dedup key prefix,
+#       then a stream index (from 1), a dedup key ('' for none) and an item for every item
+# Returns the number of skipped items.
+ADD_SCRIPT = """
+local duplicates = 0
+local window = tonumber(ARGV[1])
+for i = 3, #ARGV, 3 do
+    local dedup_key = ARGV[i + 1]
+    if window > 0 and dedup_key ~= '' and
+            not redis.call('SET', ARGV[2] .. dedup_key, 1, 'NX', 'PX', window) then
+        duplicates = duplicates + 1
+    else
+        redis.call('XADD', KEYS[tonumber(ARGV[i])], '*', 'data', ARGV[i + 2])
+    end
+end
+return duplicates
+"""
+
+# Entry read from a stream: stream name, entry id, raw item
+Entry = Tuple[str, bytes, bytes]
+
+
+class RedisStreamBatcher(BatchQueue):
+    """
+    Collects processed agent data in Redis streams read by a consumer group,
+    so any number of hub processes can share the batching.
+    Items are sharded over `shards` streams by user id; the items of one
+    vehicle stay in order within their stream. Every hub process runs one
+    consumer reading all the shards. Its entries stay pending until the store
+    dispatcher reports the batch saved or kept in the retry buffer, then they
+    are acknowledged and deleted. Every `claim_interval_ms` a consumer resets
+    the idle time of the entries it still holds (queued for the store
+    included). Entries left pending longer than `claim_idle_ms` are those of
+    a consumer that died, or of a batch the dispatcher could not keep; any
+    consumer claims them.
+    A crash between saving and acknowledging sends the batch again; the
+    dedup keys make the store insert it once.
+    """
+
+    def __init__(
+        self,
+        redis_client: Redis,
+        key: str,
+        shards: int,
+        group: str,
+        consumer: str,
+        batch_size: int,
+        linger_ms: int,
+        on_batch: Callable[..., None],
+        dedup_window_ms: int = 0,
+        dedup_key_prefix: Optional[str] = None,
+        claim_idle_ms: int = 60000,
+        claim_interval_ms: int = 5000,
+    ):
+        self.redis_client = redis_client
+        self.streams = [f"{key}:stream:{shard}" for shard in range(shards)]
+        self.group = group
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.linger_ms = linger_ms
+        self.on_batch = on_batch
+        self.dedup_window_ms = dedup_window_ms
+        self.dedup_key_prefix = dedup_key_prefix or f"{key}:dedup:"
+        self.claim_idle_ms = claim_idle_ms
+        self.claim_interval_ms = claim_interval_ms
+        self.duplicates = 0
+        self._add = redis_client.register_script(ADD_SCRIPT)
+        self._claim_cursors = {stream: "0-0" for stream in self.streams}
+        # Entries read or claimed by this consumer and not acknowledged yet
+        self._in_flight: Set[Tuple[str, bytes]] = set()
+        self._in_flight_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stream-consumer", daemon=True)
+
+    def shard(self, item: ProcessedAgentData) -> int:
+        """Index of the stream holding the items of the vehicle"""
+        return (item.agent_data.user_id or 0) % len(self.streams)
+
+    def add(self, items: List[ProcessedAgentData]):
+        """Append items to their shard streams in one script call"""
+        if not items:
+            return
+        args = [self.dedup_window_ms, self.dedup_key_prefix]
+        for item in items:
+            args.extend((self.shard(item) + 1, item.dedup_key or "", item.model_dump_json()))
+        started = time.perf_counter()
+        duplicates = self._add(keys=self.streams, args=args)
+        REDIS_PUSH_SECONDS.observe(time.perf_counter() - started)
+        if duplicates:
+            self.duplicates += duplicates
+            DUPLICATE_RECORDS_DROPPED.inc(duplicates)
+            logging.info(f"Skipped {duplicates} duplicate items")
+
+    def backlog(self) -> int:
+        """Number of items not acknowledged yet, in flight ones included"""
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for stream in self.streams:
+            pipeline.xlen(stream)
+        return sum(pipeline.execute())
+
+    def create_groups(self):
+        for stream in self.streams:
+            try:
+                self.redis_client.xgroup_create(stream, self.group, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    def start(self):
+        self.create_groups()
+        self._thread.start()
+
+    def stop(self):
+        """Stop reading; entries read but not handed out are claimed later"""
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        pending: List[Entry] = []
+        since = 0.0
+        last_claim = 0.0
+        while not self._stopped.is_set():
+            try:
+                now = time.monotonic()
+                if (now - last_claim) * 1000 >= self.claim_interval_ms:
+                    last_claim = now
+                    pending.extend(self._claim())
+                if len(pending) < self.batch_size:
+                    if pending:
+                        block_ms = self.linger_ms - (now - since) * 1000
+                    else:
+                        block_ms = min(self.linger_ms, self.claim_interval_ms)
+                    read = self._read(self.batch_size - len(pending), max(int(block_ms), 1))
+                    if read and not pending:
+                        since = time.monotonic()
+                    pending.extend(read)
+                while pending and (
+                    len(pending) >= self.batch_size
+                    or (time.monotonic() - since) * 1000 >= self.linger_ms
+                ):
+                    batch, pending = pending[:self.batch_size], pending[self.batch_size:]
+                    self._deliver(batch)
+                    since = time.monotonic()
+            except Exception as e:
+                logging.error(f"Error consuming batch stream: {e}")
+                self._stopped.wait(1)
+
+    def _read(self, count: int, block_ms: int) -> List[Entry]:
+        started = time.perf_counter()
+        response = self.redis_client.xreadgroup(
+            self.group,
+            self.consumer,
+            {stream: ">" for stream in self.streams},
+            count=count,
+            block=block_ms,
+        )
+        # Includes the time blocked waiting for entries
+        REDIS_READ_SECONDS.observe(time.perf_counter() - started)
+        entries = []
+        for stream, stream_entries in response or []:
+            stream = stream.decode() if isinstance(stream, bytes) else stream
+            for entry_id, fields in stream_entries:
+                entries.append((stream, entry_id, fields[b"data"]))
+        self._track(entries)
+        return entries
+
+    def _track(self, entries: Iterable[Entry]):
+        with self._in_flight_lock:
+            self._in_flight.update((stream, entry_id) for stream, entry_id, _ in entries)
+
+    def _refresh_in_flight(self):
+        """Reset the idle time of the entries this consumer holds, so no consumer claims them"""
+        ids: Dict[str, List[bytes]] = {}
+        with self._in_flight_lock:
+            for stream, entry_id in self._in_flight:
+                ids.setdefault(stream, []).append(entry_id)
+        if not ids:
+            return
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for stream, stream_ids in ids.items():
+            pipeline.xclaim(stream, self.group, self.consumer, 0, stream_ids, justid=True)
+        pipeline.execute()
+
+    def _claim(self) -> List[Entry]:
+        """Take over the entries other consumers left pending for too long"""
+        entries = []
+        started = time.perf_counter()
+        self._refresh_in_flight()
+        with self._in_flight_lock:
+            in_flight = set(self._in_flight)
+        for stream in self.streams:
+            response = self.redis_client.xautoclaim(
+                stream,
+                self.group,
+                self.consumer,
+                min_idle_time=self.claim_idle_ms,
+                start_id=self._claim_cursors[stream],
+                count=self.batch_size,
+            )
+            self._claim_cursors[stream] = response[0]
+            for entry_id, fields in response[1]:
+                # Entries deleted while pending come back without fields,
+                # entries of this consumer are still on their way to the store
+                if fields and (stream, entry_id) not in in_flight:
+                    entries.append((stream, entry_id, fields[b"data"]))
+        self._track(entries)
+        REDIS_CLAIM_SECONDS.observe(time.perf_counter() - started)
+        if entries:
+            logging.info(f"Claimed {len(entries)} stale stream entries")
+        return entries
+
+    def _ack(self, entries: List[Entry]):
+        ids: Dict[str, List[bytes]] = {}
+        for stream, entry_id, _ in entries:
+            ids.setdefault(stream, []).append(entry_id)
+        started = time.perf_counter()
+        pipeline = self.redis_client.pipeline()
+        for stream, stream_ids in ids.items():
+            pipeline.xack(stream, self.group, *stream_ids)
+            pipeline.xdel(stream, *stream_ids)
+        try:
+            pipeline.execute()
+            REDIS_ACK_SECONDS.observe(time.perf_counter() - started)
+        finally:
+            # Entries not acknowledged are left to XAUTOCLAIM
+            self._release(entries)
+
+    def _release(self, entries: List[Entry]):
+        """Stop holding entries, so any consumer can claim them once idle"""
+        with self._in_flight_lock:
+            self._in_flight.difference_update((stream, entry_id) for stream, entry_id, _ in entries)
+
+    def _deliver(self, entries: List[Entry]):
+        items, valid = [], []
+        for entry in entries:
+            try:
+                items.append(ProcessedAgentData.model_validate_json(entry[2]))
+                valid.append(entry)
+            except ValueError as e:
+                logging.error(f"Dropping invalid stream entry {entry[1]}: {e}")
+        if len(valid) < len(entries):
+            INVALID_RECORDS_DROPPED.inc(len(entries) - len(valid))
+            self._ack([entry for entry in entries if entry not in valid])
+        if items:
+            BATCHES_FLUSHED.inc()
+            BATCH_SIZE.observe(len(items))
+            try:
+                self.on_batch(
+                    items, on_done=lambda: self._ack(valid), on_failed=lambda: self._release(valid)
+                )
+            except Exception:
+                self._release(valid)
+                raise
@@ -1,4 +1,5 @@
 import os
+import socket
 
 
 def try_parse_int(value: str):
@@ -12,6 +13,18 @@ def try_parse_int(value: str):
 STORE_API_HOST = os.environ.get("STORE_API_HOST") or "localhost"
 STORE_API_PORT = try_parse_int(os.environ.get("STORE_API_PORT")) or 8000
 STORE_API_BASE_URL = f"http://{STORE_API_HOST}:{STORE_API_PORT}"
+# Threads sending batches to the store and the queue of batches waiting for them
+STORE_WORKERS = try_parse_int(os.environ.get("STORE_WORKERS")) or 4
+STORE_QUEUE_SIZE = try_parse_int(os.environ.get("STORE_QUEUE_SIZE")) or 100
+# Seconds a producer (e.g. the MQTT network thread) waits for room in the full
+# queue before the batch goes to the retry buffer, 0 does not wait
+STORE_QUEUE_PUT_TIMEOUT = try_parse_int(os.environ.get("STORE_QUEUE_PUT_TIMEOUT"))
+if STORE_QUEUE_PUT_TIMEOUT is None:
+    STORE_QUEUE_PUT_TIMEOUT = 0
+STORE_TIMEOUT = try_parse_int(os.environ.get("STORE_TIMEOUT")) or 10
+# Store link body format (json or msgpack) and compression (identity, gzip or zstd)
+STORE_TRANSPORT_FORMAT = os.environ.get("STORE_TRANSPORT_FORMAT") or "json"
+STORE_TRANSPORT_ENCODING = os.environ.get("STORE_TRANSPORT_ENCODING") or "identity"
 
 # Configure for Redis
 REDIS_HOST = os.environ.get("REDIS_HOST") or "localhost"
@@ -19,8 +32,52 @@ REDIS_PORT = try_parse_int(os.environ.get("REDIS_PORT")) or 6379
 
 # Configure for hub logic
 BATCH_SIZE = try_parse_int(os.environ.get("BATCH_SIZE")) or 20
+# A partial batch is flushed once its oldest item waited this long
+BATCH_LINGER_MS = try_parse_int(os.environ.get("BATCH_LINGER_MS")) or 1000
+REDIS_QUEUE_KEY = os.environ.get("REDIS_QUEUE_KEY") or "processed_agent_data"
+# Queue batching the records: a Redis list ("list", one hub instance) or
+# Redis streams read by a consumer group ("stream", any number of hub instances)
+HUB_QUEUE_MODE = os.environ.get("HUB_QUEUE_MODE") or "list"
+STREAM_SHARDS = try_parse_int(os.environ.get("STREAM_SHARDS")) or 4
+STREAM_GROUP = os.environ.get("STREAM_GROUP") or "hub"
+STREAM_CONSUMER = os.environ.get("STREAM_CONSUMER") or f"{socket.gethostname()}-{os.getpid()}"
+# Pending entries idle for this long are claimed from the consumer holding them
+STREAM_CLAIM_IDLE_MS = try_parse_int(os.environ.get("STREAM_CLAIM_IDLE_MS")) or 60000
+STREAM_CLAIM_INTERVAL_MS = try_parse_int(os.environ.get("STREAM_CLAIM_INTERVAL_MS")) or 5000
+# Records with a dedup key seen within this window are dropped, 0 disables it
+DEDUP_WINDOW_MS = try_parse_int(os.environ.get("DEDUP_WINDOW_MS"))
+if DEDUP_WINDOW_MS is None:
+    DEDUP_WINDOW_MS = 10 * 60 * 1000
+# Adaptive batching tunes the batch size and linger time within these bounds
+# from the store latency and the queue backlog, aiming at the target latency
+ADAPTIVE_BATCHING = (os.environ.get("ADAPTIVE_BATCHING") or "").lower() in ("1", "true", "yes")
+BATCH_SIZE_MIN = try_parse_int(os.environ.get("BATCH_SIZE_MIN")) or 5
+BATCH_SIZE_MAX = try_parse_int(os.environ.get("BATCH_SIZE_MAX")) or 1000
+BATCH_LINGER_MS_MIN = try_parse_int(os.environ.get("BATCH_LINGER_MS_MIN")) or 50
+BATCH_LINGER_MS_MAX = try_parse_int(os.environ.get("BATCH_LINGER_MS_MAX")) or 5000
+TARGET_LATENCY_MS = try_parse_int(os.environ.get("TARGET_LATENCY_MS")) or 1000
+BATCH_ADJUST_INTERVAL_MS = try_parse_int(os.environ.get("BATCH_ADJUST_INTERVAL_MS")) or 1000
+
+# Normal readings of a vehicle are kept at most once per interval or distance,
+# other road states are always kept. 0 disables the limit, both 0 disable downsampling
+DOWNSAMPLE_INTERVAL_MS = try_parse_int(os.environ.get("DOWNSAMPLE_INTERVAL_MS")) or 0
+DOWNSAMPLE_DISTANCE_M = try_parse_int(os.environ.get("DOWNSAMPLE_DISTANCE_M")) or 0
+DOWNSAMPLE_MAX_VEHICLES = try_parse_int(os.environ.get("DOWNSAMPLE_MAX_VEHICLES")) or 10000
+
+# Retry buffer for batches the store did not accept
+RETRY_BUFFER_KEY = os.environ.get("RETRY_BUFFER_KEY") or "processed_agent_data:retry"
+RETRY_BUFFER_MAX_BATCHES = try_parse_int(os.environ.get("RETRY_BUFFER_MAX_BATCHES")) or 10000
+RETRY_BASE_DELAY_MS = try_parse_int(os.environ.get("RETRY_BASE_DELAY_MS")) or 1000
+RETRY_MAX_DELAY_MS = try_parse_int(os.environ.get("RETRY_MAX_DELAY_MS")) or 60000
+RETRY_POLL_MS = try_parse_int(os.environ.get("RETRY_POLL_MS")) or 500
+# Batches failing this many times, or refused by the store (4xx), go to the dead letter list
+RETRY_MAX_ATTEMPTS = try_parse_int(os.environ.get("RETRY_MAX_ATTEMPTS")) or 10
+RETRY_DEAD_LETTER_KEY = os.environ.get("RETRY_DEAD_LETTER_KEY") or "processed_agent_data:dead"
+RETRY_DEAD_LETTER_MAX_BATCHES = try_parse_int(os.environ.get("RETRY_DEAD_LETTER_MAX_BATCHES")) or 1000
 
 # MQTT
 MQTT_BROKER_HOST = os.environ.get("MQTT_BROKER_HOST") or "localhost"
 MQTT_BROKER_PORT = try_parse_int(os.environ.get("MQTT_BROKER_PORT")) or 1883
 MQTT_TOPIC = os.environ.get("MQTT_TOPIC") or "processed_agent_data_topic"
+# Hub instances in the same shared subscription group split the messages between them
+MQTT_SHARED_GROUP = os.environ.get("MQTT_SHARED_GROUP")
@@ -1,10 +1,32 @@
 CREATE TABLE processed_agent_data (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     road_state VARCHAR(255) NOT NULL,
     x FLOAT,
     y FLOAT,
     z FLOAT,
     latitude FLOAT,
     longitude FLOAT,
-    timestamp TIMESTAMP
+    timestamp TIMESTAMP NOT NULL,
+    cell BIGINT,
+    dedup_key VARCHAR,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Rows outside of the daily partitions created by the store land here
+CREATE TABLE processed_agent_data_default PARTITION OF processed_agent_data DEFAULT;
+
+CREATE INDEX ix_processed_agent_data_timestamp ON processed_agent_data (timestamp);
+CREATE INDEX ix_processed_agent_data_cell ON processed_agent_data (cell);
+-- Idempotency key set by the edge, the store skips rows whose key is already stored
+CREATE UNIQUE INDEX ux_processed_agent_data_dedup_key ON processed_agent_data (dedup_key, timestamp);
+
+-- Row counts per web map tile, road state and time bucket, kept up to date by the store on insert
+CREATE TABLE hazard_heatmap (
+    zoom INTEGER,
+    tile_x INTEGER,
+    tile_y INTEGER,
+    road_state VARCHAR,
+    bucket TIMESTAMP,
+    count BIGINT NOT NULL,
+    PRIMARY KEY (zoom, tile_x, tile_y, road_state, bucket)
 );
\ No newline at end of file
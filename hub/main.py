@@ -1,18 +1,68 @@
 import logging
 from typing import List
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from redis import Redis
 import paho.mqtt.client as mqtt
 
 from app.adapters.store_api_adapter import StoreApiAdapter
 from app.entities.processed_agent_data import ProcessedAgentData
+from app.usecases.adaptive_batching import AdaptiveBatchController
+from app.usecases.batching import RedisBatcher
+from app.usecases.bulk_ingest import parse_bulk, parse_json_array
+from app.usecases.downsampling import NormalReadingSampler
+from app.usecases.metrics import (
+    DOWNSAMPLED_RECORDS_DROPPED,
+    HTTP_MESSAGES_RECEIVED,
+    INVALID_RECORDS_DROPPED,
+    MQTT_MESSAGES_RECEIVED,
+    register_state_collector,
+)
+from app.usecases.retry_buffer import RedisRetryBuffer
+from app.usecases.stream_batching import RedisStreamBatcher
+from app.usecases.store_dispatcher import StoreDispatcher
 from config import (
     STORE_API_BASE_URL,
+    STORE_WORKERS,
+    STORE_QUEUE_SIZE,
+    STORE_QUEUE_PUT_TIMEOUT,
+    STORE_TIMEOUT,
+    STORE_TRANSPORT_FORMAT,
+    STORE_TRANSPORT_ENCODING,
     REDIS_HOST,
     REDIS_PORT,
     BATCH_SIZE,
+    BATCH_LINGER_MS,
+    REDIS_QUEUE_KEY,
+    HUB_QUEUE_MODE,
+    STREAM_SHARDS,
+    STREAM_GROUP,
+    STREAM_CONSUMER,
+    STREAM_CLAIM_IDLE_MS,
+    STREAM_CLAIM_INTERVAL_MS,
+    DEDUP_WINDOW_MS,
+    DOWNSAMPLE_INTERVAL_MS,
+    DOWNSAMPLE_DISTANCE_M,
+    DOWNSAMPLE_MAX_VEHICLES,
+    ADAPTIVE_BATCHING,
+    BATCH_SIZE_MIN,
+    BATCH_SIZE_MAX,
+    BATCH_LINGER_MS_MIN,
+    BATCH_LINGER_MS_MAX,
+    TARGET_LATENCY_MS,
+    BATCH_ADJUST_INTERVAL_MS,
+    RETRY_BUFFER_KEY,
+    RETRY_BUFFER_MAX_BATCHES,
+    RETRY_BASE_DELAY_MS,
+    RETRY_MAX_DELAY_MS,
+    RETRY_POLL_MS,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_DEAD_LETTER_KEY,
+    RETRY_DEAD_LETTER_MAX_BATCHES,
     MQTT_TOPIC,
+    MQTT_SHARED_GROUP,
     MQTT_BROKER_HOST,
     MQTT_BROKER_PORT,
 )
@@ -29,7 +79,91 @@ logging.basicConfig(
 # Create an instance of the Redis using the configuration
 redis_client = Redis(host=REDIS_HOST, port=REDIS_PORT)
 # Create an instance of the StoreApiAdapter using the configuration
-store_adapter = StoreApiAdapter(api_base_url=STORE_API_BASE_URL)
+store_adapter = StoreApiAdapter(
+    api_base_url=STORE_API_BASE_URL,
+    timeout=STORE_TIMEOUT,
+    pool_size=STORE_WORKERS,
+    format=STORE_TRANSPORT_FORMAT,
+    encoding=STORE_TRANSPORT_ENCODING,
+)
+# Create an instance of the RedisRetryBuffer keeping batches the store did not accept
+retry_buffer = RedisRetryBuffer(
+    redis_client=redis_client,
+    key=RETRY_BUFFER_KEY,
+    max_batches=RETRY_BUFFER_MAX_BATCHES,
+    base_delay_ms=RETRY_BASE_DELAY_MS,
+    max_delay_ms=RETRY_MAX_DELAY_MS,
+    max_attempts=RETRY_MAX_ATTEMPTS,
+    dead_letter_key=RETRY_DEAD_LETTER_KEY,
+    max_dead_letters=RETRY_DEAD_LETTER_MAX_BATCHES,
+)
+# Create an instance of the StoreDispatcher sending batches from worker threads
+store_dispatcher = StoreDispatcher(
+    store_gateway=store_adapter,
+    workers=STORE_WORKERS,
+    queue_size=STORE_QUEUE_SIZE,
+    put_timeout=STORE_QUEUE_PUT_TIMEOUT,
+    retry_buffer=retry_buffer,
+    retry_poll_interval=RETRY_POLL_MS / 1000,
+)
+# Create the batch queue handing full batches to the dispatcher
+if HUB_QUEUE_MODE == "stream":
+    batcher = RedisStreamBatcher(
+        redis_client=redis_client,
+        key=REDIS_QUEUE_KEY,
+        shards=STREAM_SHARDS,
+        group=STREAM_GROUP,
+        consumer=STREAM_CONSUMER,
+        batch_size=BATCH_SIZE,
+        linger_ms=BATCH_LINGER_MS,
+        on_batch=store_dispatcher.submit,
+        dedup_window_ms=DEDUP_WINDOW_MS,
+        claim_idle_ms=STREAM_CLAIM_IDLE_MS,
+        claim_interval_ms=STREAM_CLAIM_INTERVAL_MS,
+    )
+else:
+    batcher = RedisBatcher(
+        redis_client=redis_client,
+        key=REDIS_QUEUE_KEY,
+        batch_size=BATCH_SIZE,
+        linger_ms=BATCH_LINGER_MS,
+        on_batch=store_dispatcher.submit,
+        dedup_window_ms=DEDUP_WINDOW_MS,
+    )
+# Create an instance of the AdaptiveBatchController tuning the batcher from the store latency
+batch_controller = None
+if ADAPTIVE_BATCHING:
+    batch_controller = AdaptiveBatchController(
+        batcher=batcher,
+        min_batch_size=BATCH_SIZE_MIN,
+        max_batch_size=BATCH_SIZE_MAX,
+        min_linger_ms=BATCH_LINGER_MS_MIN,
+        max_linger_ms=BATCH_LINGER_MS_MAX,
+        target_latency_ms=TARGET_LATENCY_MS,
+        interval_ms=BATCH_ADJUST_INTERVAL_MS,
+    )
+    store_dispatcher.on_latency = batch_controller.observe_store_latency
+# Create an instance of the NormalReadingSampler thinning normal readings before they are queued
+sampler = None
+if DOWNSAMPLE_INTERVAL_MS > 0 or DOWNSAMPLE_DISTANCE_M > 0:
+    sampler = NormalReadingSampler(
+        interval_ms=DOWNSAMPLE_INTERVAL_MS,
+        distance_m=DOWNSAMPLE_DISTANCE_M,
+        max_vehicles=DOWNSAMPLE_MAX_VEHICLES,
+    )
+
+
+def queue_items(items: List[ProcessedAgentData]):
+    """Downsample the items and queue the rest for the store"""
+    if sampler is not None:
+        kept = sampler.filter(items)
+        DOWNSAMPLED_RECORDS_DROPPED.inc(len(items) - len(kept))
+        items = kept
+    batcher.add(items)
+
+
+# Report the queue, dispatcher and retry buffer state on /metrics
+register_state_collector(batcher, store_dispatcher, retry_buffer)
 # Create an instance of the AgentMQTTAdapter using the configuration
 
 # FastAPI
@@ -37,20 +171,54 @@ app = FastAPI()
 
 
 @app.post("/processed_agent_data/")
-async def save_processed_agent_data(processed_agent_data: ProcessedAgentData):
-    redis_client.lpush("processed_agent_data", processed_agent_data.model_dump_json())
-    if redis_client.llen("processed_agent_data") >= BATCH_SIZE:
-        processed_agent_data_batch: List[ProcessedAgentData] = []
-        for _ in range(BATCH_SIZE):
-            processed_agent_data = ProcessedAgentData.model_validate_json(
-                redis_client.lpop("processed_agent_data")
-            )
-            processed_agent_data_batch.append(processed_agent_data)
-        print(processed_agent_data_batch)
-        store_adapter.save_data(processed_agent_data_batch=processed_agent_data_batch)
+def save_processed_agent_data(processed_agent_data: ProcessedAgentData):
+    HTTP_MESSAGES_RECEIVED.inc()
+    queue_items([processed_agent_data])
     return {"status": "ok"}
 
 
+@app.post("/processed_agent_data/bulk")
+async def save_processed_agent_data_bulk(request: Request):
+    """
+    Accept a JSON array or, with Content-Type application/x-ndjson, one record per line.
+    Valid records are queued in one batcher call; invalid ones are reported by index.
+    """
+    body = await request.body()
+    try:
+        items, errors = parse_bulk(body, request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    HTTP_MESSAGES_RECEIVED.inc(len(items) + len(errors))
+    INVALID_RECORDS_DROPPED.inc(len(errors))
+    await run_in_threadpool(queue_items, items)
+    return {"status": "ok", "accepted": len(items), "rejected": len(errors), "errors": errors}
+
+
+@app.get("/batching/")
+def read_batching_state():
+    if batch_controller is not None:
+        return batch_controller.state()
+    return {
+        "adaptive": False,
+        "mode": HUB_QUEUE_MODE,
+        "batch_size": batcher.batch_size,
+        "linger_ms": batcher.linger_ms,
+        "backlog": batcher.backlog(),
+        "duplicates": batcher.duplicates,
+    }
+
+
+@app.get("/metrics")
+def read_metrics():
+    """Prometheus metrics of the hub"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/retry_buffer/")
+def read_retry_buffer_stats():
+    return retry_buffer.stats()
+
+
 # MQTT
 client = mqtt.Client()
 
@@ -58,31 +226,36 @@ client = mqtt.Client()
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
         logging.info("Connected to MQTT broker")
-        client.subscribe(MQTT_TOPIC)
+        if MQTT_SHARED_GROUP:
+            client.subscribe(f"$share/{MQTT_SHARED_GROUP}/{MQTT_TOPIC}")
+        else:
+            client.subscribe(MQTT_TOPIC)
     else:
         logging.info(f"Failed to connect to MQTT broker with code: {rc}")
 
 
 def on_message(client, userdata, msg):
     try:
-        payload: str = msg.payload.decode("utf-8")
-        # Create ProcessedAgentData instance with the received data
-        processed_agent_data = ProcessedAgentData.model_validate_json(
-            payload, strict=True
-        )
-
-        redis_client.lpush(
-            "processed_agent_data", processed_agent_data.model_dump_json()
-        )
-        processed_agent_data_batch: List[ProcessedAgentData] = []
-        if redis_client.llen("processed_agent_data") >= BATCH_SIZE:
-            for _ in range(BATCH_SIZE):
-                processed_agent_data = ProcessedAgentData.model_validate_json(
-                    redis_client.lpop("processed_agent_data")
-                )
-                processed_agent_data_batch.append(processed_agent_data)
-        store_adapter.save_data(processed_agent_data_batch=processed_agent_data_batch)
-        return {"status": "ok"}
+        # A JSON array carries a batch of records from the edge
+        if msg.payload.lstrip().startswith(b"["):
+            items, errors = parse_json_array(msg.payload)
+        else:
+            payload: str = msg.payload.decode("utf-8")
+            # Create ProcessedAgentData instance with the received data
+            items = [ProcessedAgentData.model_validate_json(payload, strict=True)]
+            errors = []
+    except Exception as e:
+        MQTT_MESSAGES_RECEIVED.inc()
+        INVALID_RECORDS_DROPPED.inc()
+        logging.info(f"Error processing MQTT message: {e}")
+        return
+
+    MQTT_MESSAGES_RECEIVED.inc(len(items) + len(errors))
+    if errors:
+        INVALID_RECORDS_DROPPED.inc(len(errors))
+        logging.info(f"Invalid records in MQTT message: {errors}")
+    try:
+        queue_items(items)
     except Exception as e:
         logging.info(f"Error processing MQTT message: {e}")
 
@@ -94,3 +267,7 @@ client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT)
 
 # Start
 client.loop_start()
+store_dispatcher.start()
+batcher.start()
+if batch_controller is not None:
+    batch_controller.start()
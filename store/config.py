@@ -11,3 +11,49 @@ POSTGRES_PORT = try_parse(int, os.environ.get("POSTGRES_PORT")) or 5432
 POSTGRES_USER = os.environ.get("POSTGRES_USER") or "myadmin"
 POSTGRES_PASSWORD = os.environ.get("POSTGRES_PASS") or "pass"
 POSTGRES_DB = os.environ.get("POSTGRES_DB") or "flexibleserverdb"
+
+# Async connection pool for the store database
+DB_POOL_SIZE = try_parse(int, os.environ.get("DB_POOL_SIZE")) or 10
+DB_MAX_OVERFLOW = try_parse(int, os.environ.get("DB_MAX_OVERFLOW")) or 20
+DB_POOL_RECYCLE = try_parse(int, os.environ.get("DB_POOL_RECYCLE")) or 1800
+DB_POOL_TIMEOUT = try_parse(float, os.environ.get("DB_POOL_TIMEOUT")) or 30
+
+# Bulk ingest limits for POST /processed_agent_data/
+MAX_BATCH_SIZE = try_parse(int, os.environ.get("MAX_BATCH_SIZE")) or 10000
+INSERT_CHUNK_SIZE = try_parse(int, os.environ.get("INSERT_CHUNK_SIZE")) or 1000
+# Largest request body accepted after decompression
+MAX_BODY_BYTES = try_parse(int, os.environ.get("MAX_BODY_BYTES")) or 64 * 1024 * 1024
+
+# Listing of processed_agent_data
+DEFAULT_PAGE_SIZE = try_parse(int, os.environ.get("DEFAULT_PAGE_SIZE")) or 100
+MAX_PAGE_SIZE = try_parse(int, os.environ.get("MAX_PAGE_SIZE")) or 1000
+STREAM_CHUNK_SIZE = try_parse(int, os.environ.get("STREAM_CHUNK_SIZE")) or 1000
+
+# Websocket change feed
+WS_FEED_HISTORY_SIZE = try_parse(int, os.environ.get("WS_FEED_HISTORY_SIZE")) or 10000
+# Batches of frames (one per insert) a subscriber may have waiting to be sent
+WS_SEND_QUEUE_SIZE = try_parse(int, os.environ.get("WS_SEND_QUEUE_SIZE")) or 1000
+# What to do when a subscriber's send queue is full: drop_oldest, coalesce or disconnect
+WS_SLOW_CONSUMER_POLICY = os.environ.get("WS_SLOW_CONSUMER_POLICY") or "drop_oldest"
+
+# Spatial grid used to index processed_agent_data by location.
+# Changing GRID_CELL_DEG invalidates the cell column of rows already stored.
+GRID_CELL_DEG = try_parse(float, os.environ.get("GRID_CELL_DEG")) or 0.01
+BBOX_MAX_CELL_ROWS = try_parse(int, os.environ.get("BBOX_MAX_CELL_ROWS")) or 256
+BBOX_MAX_POINTS = try_parse(int, os.environ.get("BBOX_MAX_POINTS")) or 10000
+
+# Daily partitions of processed_agent_data and their retention.
+# RETENTION_DAYS = 0 keeps every partition, RETENTION_MODE is drop or detach.
+PARTITION_PREMAKE_DAYS = try_parse(int, os.environ.get("PARTITION_PREMAKE_DAYS")) or 3
+RETENTION_DAYS = try_parse(int, os.environ.get("RETENTION_DAYS")) or 0
+RETENTION_MODE = os.environ.get("RETENTION_MODE") or "drop"
+PARTITION_MAINTENANCE_INTERVAL = try_parse(int, os.environ.get("PARTITION_MAINTENANCE_INTERVAL")) or 3600
+
+# Hazard heatmap aggregates: web map zoom levels they are kept at and time bucket size
+HEATMAP_ZOOMS = try_parse(
+    lambda value: [int(zoom) for zoom in value.split(",")], os.environ.get("HEATMAP_ZOOMS")
+) or [8, 12, 16]
+HEATMAP_BUCKET_SECONDS = try_parse(int, os.environ.get("HEATMAP_BUCKET_SECONDS")) or 3600
+
+# Rows per chunk (record batch / row group) of /processed_agent_data/export
+EXPORT_CHUNK_SIZE = try_parse(int, os.environ.get("EXPORT_CHUNK_SIZE")) or 50000
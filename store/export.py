@@ -0,0 +1,134 @@
+import csv
+import io
+from typing import Any, List, Sequence
+
+from sqlalchemy import BigInteger, DateTime, Float, Integer, String, Table
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Arrow and Parquet exports fall back to CSV
+    pa = None
+    pq = None
+
+EXPORT_FORMATS = ("arrow", "parquet", "csv")
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file collecting what was written since the last take()"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def arrow_schema(table: Table):
+    """Build the Arrow schema matching the table columns"""
+    fields = []
+    for column in table.c:
+        if isinstance(column.type, BigInteger):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, Integer):
+            arrow_type = pa.int32()
+        elif isinstance(column.type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(column.type, DateTime):
+            arrow_type = pa.timestamp("us")
+        elif isinstance(column.type, String):
+            arrow_type = pa.string()
+        else:
+            raise TypeError(f"No Arrow type for column {column.name} ({column.type})")
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+class CsvEncoder:
+    media_type = "text/csv"
+    extension = "csv"
+
+    def __init__(self, table: Table):
+        self.columns = [column.name for column in table.c]
+
+    def _write(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+
+    def begin(self) -> bytes:
+        return self._write([self.columns])
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        return self._write(rows)
+
+    def end(self) -> bytes:
+        return b""
+
+
+class ArrowEncoder:
+    """Arrow IPC stream, one record batch per chunk of rows"""
+
+    media_type = "application/vnd.apache.arrow.stream"
+    extension = "arrows"
+
+    def __init__(self, table: Table):
+        self.schema = arrow_schema(table)
+        self.sink = ChunkSink()
+        self.writer = None
+
+    def _open_writer(self):
+        return pa.ipc.new_stream(self.sink, self.schema)
+
+    def _record_batch(self, rows: Sequence[Sequence[Any]]):
+        columns = list(zip(*rows))
+        return pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema,
+        )
+
+    def begin(self) -> bytes:
+        self.writer = self._open_writer()
+        return self.sink.take()
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        self.writer.write_batch(self._record_batch(rows))
+        return self.sink.take()
+
+    def end(self) -> bytes:
+        self.writer.close()
+        return self.sink.take()
+
+
+class ParquetEncoder(ArrowEncoder):
+    """Parquet file, one row group per chunk of rows"""
+
+    media_type = "application/vnd.apache.parquet"
+    extension = "parquet"
+
+    def _open_writer(self):
+        return pq.ParquetWriter(self.sink, self.schema)
+
+
+def make_encoder(format: str, table: Table):
+    """Return the encoder for the export format, CSV when pyarrow is not installed"""
+    if format == "csv" or pa is None:
+        return CsvEncoder(table)
+    if format == "parquet":
+        return ParquetEncoder(table)
+    return ArrowEncoder(table)
@@ -0,0 +1,141 @@
+import asyncio
+import json
+from collections import deque
+from itertools import islice
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+
+class Subscriber:
+    """
+    A websocket connected to the change feed.
+    Frames are queued in a bounded queue and sent by the subscriber's own
+    task, so a slow client only ever delays itself. Every queue entry holds
+    the frames of one publish call (or of the replay), so the queue bounds
+    the number of batches waiting, whatever their size.
+    """
+
+    def __init__(self, websocket: WebSocket, queue_size: int, policy: str):
+        self.websocket = websocket
+        self.policy = policy
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def offer(self, frames: List[str]) -> bool:
+        """
+        Queue frames, applying the slow consumer policy when the queue is full.
+        Returns False when the subscriber has to be disconnected.
+        """
+        try:
+            self.queue.put_nowait(frames)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.policy == "disconnect":
+            return False
+        if self.policy == "coalesce":
+            # The client only gets the newest frames, it can catch up with ?since=
+            while not self.queue.empty():
+                self.dropped += len(self.queue.get_nowait())
+        else:
+            self.dropped += len(self.queue.get_nowait())
+        self.queue.put_nowait(frames)
+        return True
+
+    async def run(self):
+        """Drain the queue into the websocket"""
+        try:
+            while True:
+                frames = await self.queue.get()
+                for frame in frames:
+                    await self.websocket.send_text(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Websocket subscriber stopped: {e}")
+
+
+class ChangeFeed:
+    """
+    In-process feed of newly inserted processed_agent_data rows.
+    The ingest path publishes every inserted row once; each row gets a
+    monotonically increasing sequence number and is encoded to JSON a single
+    time. The last `history_size` frames are kept so subscribers can resume
+    from the sequence they saw last.
+    """
+
+    def __init__(self, history_size: int, queue_size: int, policy: str):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(
+                f"Unknown slow consumer policy {policy!r}, expected one of {SLOW_CONSUMER_POLICIES}"
+            )
+        self.queue_size = queue_size
+        self.policy = policy
+        self._history: Deque[Tuple[int, str]] = deque(maxlen=history_size)
+        self._last_seq = 0
+        self._subscribers: Set[Subscriber] = set()
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    def publish(self, items: List[Dict[str, Any]]):
+        """Encode items once and queue them for every subscriber as one entry"""
+        if not items:
+            return
+        frames = []
+        for item in items:
+            self._last_seq += 1
+            frame = json.dumps({**item, "seq": self._last_seq}, separators=(",", ":"))
+            self._history.append((self._last_seq, frame))
+            frames.append(frame)
+        for subscriber in list(self._subscribers):
+            if not subscriber.offer(frames):
+                print("Disconnecting slow websocket subscriber")
+                self.unsubscribe(subscriber)
+                asyncio.create_task(subscriber.websocket.close(code=1013))
+
+    def frames_after(self, seq: int) -> List[Tuple[int, str]]:
+        """Return the retained frames with a sequence number greater than seq"""
+        if not self._history:
+            return []
+        first_seq = self._history[0][0]
+        return list(islice(self._history, max(seq - first_seq + 1, 0), None))
+
+    def subscribe(self, websocket: WebSocket, since: Optional[int] = None) -> Subscriber:
+        """
+        Register a websocket and start its sender task.
+        Frames newer than `since` are replayed first, as one queue entry. If
+        some of them are no longer retained, the replay starts with a
+        {"event": "truncated", "since": ..., "first_seq": ...} frame giving
+        the first sequence number that follows. Without `since` (or when it
+        is ahead of the feed, e.g. after a store restart) the subscriber
+        starts from the most recent frame.
+        """
+        frames = []
+        if since is None or since > self._last_seq:
+            since = max(self._last_seq - 1, 0)
+        else:
+            first_seq = self._history[0][0] if self._history else self._last_seq + 1
+            if since + 1 < first_seq:
+                frames.append(json.dumps(
+                    {"event": "truncated", "since": since, "first_seq": first_seq},
+                    separators=(",", ":"),
+                ))
+        frames.extend(frame for _, frame in self.frames_after(since))
+        subscriber = Subscriber(websocket, self.queue_size, self.policy)
+        if frames:
+            subscriber.offer(frames)
+        self._subscribers.add(subscriber)
+        subscriber.task = asyncio.create_task(subscriber.run())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+        if subscriber.task is not None:
+            subscriber.task.cancel()
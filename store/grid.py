@@ -0,0 +1,65 @@
+import math
+from typing import List, Optional, Tuple
+
+from config import GRID_CELL_DEG, BBOX_MAX_CELL_ROWS
+
+# Number of grid cells in one row (one band of latitude)
+GRID_COLUMNS = math.ceil(360 / GRID_CELL_DEG)
+GRID_ROWS = math.ceil(180 / GRID_CELL_DEG)
+# Web map tiles only cover latitudes up to this value
+MAX_TILE_LATITUDE = 85.05112878
+
+
+def tile_xy(latitude: float, longitude: float, zoom: int) -> Tuple[int, int]:
+    """Return the (x, y) of the web map (slippy map) tile containing the point"""
+    n = 1 << zoom
+    latitude = min(max(latitude, -MAX_TILE_LATITUDE), MAX_TILE_LATITUDE)
+    lat_rad = math.radians(latitude)
+    x = int((longitude + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(lat_rad)) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_center(x: int, y: int, zoom: int) -> Tuple[float, float]:
+    """Return the (latitude, longitude) of the center of a web map tile"""
+    n = 1 << zoom
+    longitude = (x + 0.5) / n * 360 - 180
+    latitude = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 0.5) / n))))
+    return latitude, longitude
+
+
+def cell_row_col(latitude: float, longitude: float) -> Tuple[int, int]:
+    """Return the (row, column) of the grid cell containing the point"""
+    row = int(math.floor((latitude + 90) / GRID_CELL_DEG))
+    col = int(math.floor((longitude + 180) / GRID_CELL_DEG))
+    return min(max(row, 0), GRID_ROWS - 1), min(max(col, 0), GRID_COLUMNS - 1)
+
+
+def cell_id(latitude: float, longitude: float) -> Optional[int]:
+    """
+    Return the id of the grid cell containing the point.
+    Cells of one row have consecutive ids, so a bounding box maps to one id
+    range per row. Points with NaN or infinite coordinates have no cell.
+    """
+    if not (math.isfinite(latitude) and math.isfinite(longitude)):
+        return None
+    row, col = cell_row_col(latitude, longitude)
+    return row * GRID_COLUMNS + col
+
+
+def cell_ranges(
+    min_lat: float, min_lon: float, max_lat: float, max_lon: float
+) -> List[Tuple[int, int]]:
+    """
+    Return inclusive cell id ranges covering the bounding box.
+    Boxes spanning more than BBOX_MAX_CELL_ROWS rows are covered by a single
+    range from the first to the last cell, which is a superset of the box.
+    """
+    min_row, min_col = cell_row_col(min_lat, min_lon)
+    max_row, max_col = cell_row_col(max_lat, max_lon)
+    if max_row - min_row + 1 > BBOX_MAX_CELL_ROWS:
+        return [(min_row * GRID_COLUMNS + min_col, max_row * GRID_COLUMNS + max_col)]
+    return [
+        (row * GRID_COLUMNS + min_col, row * GRID_COLUMNS + max_col)
+        for row in range(min_row, max_row + 1)
+    ]
@@ -0,0 +1,69 @@
+import math
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Mapping, Tuple
+
+from config import HEATMAP_ZOOMS, HEATMAP_BUCKET_SECONDS
+from grid import tile_xy
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def time_bucket(timestamp: datetime) -> datetime:
+    """Return the start of the HEATMAP_BUCKET_SECONDS long bucket containing the timestamp"""
+    seconds = int((timestamp.replace(tzinfo=None) - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=seconds - seconds % HEATMAP_BUCKET_SECONDS)
+
+
+def heatmap_deltas(
+    added: Iterable[Mapping[str, Any]] = (),
+    removed: Iterable[Mapping[str, Any]] = (),
+) -> List[Dict[str, Any]]:
+    """
+    Count added minus removed processed_agent_data rows per zoom × tile ×
+    road_state × time bucket.
+    Returns one hazard_heatmap row per non-zero count, sorted by key so
+    concurrent upserts lock aggregate rows in the same order. Rows with NaN
+    or infinite coordinates are on no tile and are not counted.
+    """
+    counts: Counter = Counter()
+    for rows, sign in ((added, 1), (removed, -1)):
+        for row in rows:
+            if not (math.isfinite(row["latitude"]) and math.isfinite(row["longitude"])):
+                continue
+            bucket = time_bucket(row["timestamp"])
+            for zoom in HEATMAP_ZOOMS:
+                x, y = tile_xy(row["latitude"], row["longitude"], zoom)
+                counts[(zoom, x, y, row["road_state"], bucket)] += sign
+    return [
+        {
+            "zoom": zoom,
+            "tile_x": x,
+            "tile_y": y,
+            "road_state": road_state,
+            "bucket": bucket,
+            "count": count,
+        }
+        for (zoom, x, y, road_state, bucket), count in sorted(counts.items())
+        if count != 0
+    ]
+
+
+def heatmap_level(zoom: int) -> int:
+    """Pick the maintained zoom level used to answer a tile request at zoom"""
+    for level in sorted(HEATMAP_ZOOMS):
+        if level >= zoom:
+            return level
+    return max(HEATMAP_ZOOMS)
+
+
+def tile_range(x: int, y: int, zoom: int, level: int) -> Tuple[int, int, int, int]:
+    """
+    Return the inclusive (min_x, max_x, min_y, max_y) tile range at level
+    covering tile (x, y) at zoom.
+    """
+    if level >= zoom:
+        shift = level - zoom
+        return x << shift, ((x + 1) << shift) - 1, y << shift, ((y + 1) << shift) - 1
+    shift = zoom - level
+    return x >> shift, x >> shift, y >> shift, y >> shift
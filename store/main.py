@@ -1,23 +1,39 @@
 import asyncio
 import json
-from typing import Set, Dict, List, Any
+from contextlib import asynccontextmanager
+from typing import Dict, List, Any, Optional, Literal
 
 import uvicorn
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Body
+from fastapi import (
+    FastAPI,
+    HTTPException,
+    WebSocket,
+    WebSocketDisconnect,
+    Body,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
 from sqlalchemy import (
-    create_engine,
     MetaData,
     Table,
     Column,
     Integer,
+    BigInteger,
     String,
     Float,
     DateTime,
+    Index,
+    tuple_,
+    or_,
 )
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import select, delete, update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.sql import select, delete, update, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from datetime import datetime
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, TypeAdapter, ValidationError, field_validator
 from pydantic.json import pydantic_encoder
 from config import (
     POSTGRES_HOST,
@@ -25,124 +41,362 @@ from config import (
     POSTGRES_DB,
     POSTGRES_USER,
     POSTGRES_PASSWORD,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE,
+    DB_POOL_TIMEOUT,
+    MAX_BATCH_SIZE,
+    INSERT_CHUNK_SIZE,
+    MAX_BODY_BYTES,
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    STREAM_CHUNK_SIZE,
+    WS_FEED_HISTORY_SIZE,
+    WS_SEND_QUEUE_SIZE,
+    WS_SLOW_CONSUMER_POLICY,
+    BBOX_MAX_POINTS,
+    EXPORT_CHUNK_SIZE,
+)
+from feed import ChangeFeed
+from grid import cell_id, cell_ranges, tile_center
+from heatmap import heatmap_deltas, heatmap_level, tile_range
+from export import make_encoder
+from transport import (
+    MSGPACK_MEDIA_TYPES,
+    BodyTooLarge,
+    UnsupportedTransport,
+    check_media_type,
+    decompress,
+    msgpack_records,
+    supported_encodings,
+    supported_media_types,
 )
+from partitions import maintain_partitions, run_partition_maintenance
 import models
-from models.modelsDB import ProcessedAgentDataInDB
-from models.modelsFastAPI import ProcessedAgentData
+from models.modelsDB import ProcessedAgentDataInDB, HazardHeatmapCell
+from models.modelsFastAPI import (
+    ProcessedAgentData,
+    ProcessedAgentDataFilter,
+    ProcessedAgentDataBatchUpdate,
+    ProcessedAgentDataBatchDelete,
+    ProcessedAgentDataBatchResult,
+    UtcDatetime,
+)
 import random
 
-DATABASE_URL = f"postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
-engine = create_engine(DATABASE_URL)
+DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+engine = create_async_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_pre_ping=True,
+)
 metadata = MetaData()
 # Define the ProcessedAgentData table
 processed_agent_data = Table(
     "processed_agent_data",
     metadata,
-Column("id", Integer, primary_key=True, index=True),
+    Column("id", Integer, primary_key=True, autoincrement=True),
     Column("road_state", String),
     Column("x", Float),
     Column("y", Float),
     Column("z", Float),
     Column("latitude", Float),
     Column("longitude", Float),
-    Column("timestamp", DateTime),
+    # Part of the primary key because the table is partitioned by day on it
+    Column("timestamp", DateTime, primary_key=True, index=True),
+    # Spatial grid cell of (latitude, longitude), see grid.py
+    Column("cell", BigInteger, index=True),
+    # Idempotency key set by the edge, retried records with the same key are inserted once
+    Column("dedup_key", String, nullable=True),
+    Index("ux_processed_agent_data_dedup_key", "dedup_key", "timestamp", unique=True),
+    postgresql_partition_by="RANGE (timestamp)",
+)
+# Row counts per web map tile × road_state × time bucket, see heatmap.py
+hazard_heatmap = Table(
+    "hazard_heatmap",
+    metadata,
+    Column("zoom", Integer, primary_key=True),
+    Column("tile_x", Integer, primary_key=True),
+    Column("tile_y", Integer, primary_key=True),
+    Column("road_state", String, primary_key=True),
+    Column("bucket", DateTime, primary_key=True),
+    Column("count", BigInteger, nullable=False),
 )
-SessionLocal = sessionmaker(bind=engine)
-metadata.create_all(engine)
+SessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
 
-# FastAPI app setup
-app = FastAPI()
+# asyncpg refuses statements with more bind parameters than this
+MAX_QUERY_PARAMS = 32767
+# Rows per multi-row INSERT, within the bind parameter limit
+insert_chunk_size = min(INSERT_CHUNK_SIZE, MAX_QUERY_PARAMS // len(processed_agent_data.c))
 
-# WebSocket subscriptions
-subscriptions: Set[WebSocket] = set()
 
-# FastAPI WebSocket endpoint
-import random
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    # Partitions for the coming days have to exist before the first insert
+    await maintain_partitions(engine, processed_agent_data.name, hazard_heatmap.name)
+    maintenance = asyncio.create_task(
+        run_partition_maintenance(engine, processed_agent_data.name, hazard_heatmap.name)
+    )
+    yield
+    maintenance.cancel()
+    await engine.dispose()
+
 
+# FastAPI app setup
+app = FastAPI(lifespan=lifespan)
+
+# Change feed shared by all websocket subscribers
+change_feed = ChangeFeed(
+    history_size=WS_FEED_HISTORY_SIZE,
+    queue_size=WS_SEND_QUEUE_SIZE,
+    policy=WS_SLOW_CONSUMER_POLICY,
+)
 
+
+# FastAPI WebSocket endpoint
 @app.websocket("/ws/")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, since: Optional[int] = None):
+    """
+    Push newly inserted rows to the client as they are published to the
+    change feed. Every message carries a `seq`; reconnecting with
+    ?since=<seq> resumes right after the last message the client received;
+    when the feed no longer holds all of them, a "truncated" event message
+    comes first.
+    """
     await websocket.accept()
-    subscriptions.add(websocket)
-
+    subscriber = change_feed.subscribe(websocket, since)
     try:
+        # Only used to notice the disconnect, clients are not expected to send anything
         while True:
-            with SessionLocal() as session:
-                query = select(
-                    processed_agent_data.c.latitude,
-                    processed_agent_data.c.longitude,
-                    processed_agent_data.c.road_state
-                ).order_by(processed_agent_data.c.timestamp.desc()).limit(1)
-
-                result = session.execute(query).fetchone()
-            if result:
-                latitude, longitude, road_state = result
-                if road_state is None:
-                    road_state = "normal"
-
-                data = {
-                    "latitude": latitude,
-                    "longitude": longitude,
-                    "road_state": road_state
-                }
-                await send_data_to_subscribers(data)
-            await asyncio.sleep(1)
-
+            await websocket.receive_text()
     except WebSocketDisconnect:
-        subscriptions.remove(websocket)
+        pass
+    finally:
+        change_feed.unsubscribe(subscriber)
+
+
+# FastAPI CRUDL endpoints
+def processed_agent_data_row_to_dict(row) -> Dict[str, Any]:
+    """Convert a processed_agent_data row into a JSON-compatible dict"""
+    item = dict(row._mapping)
+    item["timestamp"] = item["timestamp"].isoformat()
+    return item
+
+
+def processed_agent_data_row_to_json(row) -> str:
+    """Encode a processed_agent_data row as a compact JSON document"""
+    return json.dumps(processed_agent_data_row_to_dict(row), separators=(",", ":"))
+
+
+def processed_agent_data_to_row(item: ProcessedAgentData, dedup_key: bool = True) -> Dict[str, Any]:
+    """Flatten a ProcessedAgentData item into a processed_agent_data row"""
+    row = {
+        "road_state": item.road_state,
+        "x": item.agent_data.accelerometer.x,
+        "y": item.agent_data.accelerometer.y,
+        "z": item.agent_data.accelerometer.z,
+        "latitude": item.agent_data.gps.latitude,
+        "longitude": item.agent_data.gps.longitude,
+        "timestamp": item.agent_data.timestamp,
+        "cell": cell_id(item.agent_data.gps.latitude, item.agent_data.gps.longitude),
+    }
+    if dedup_key:
+        row["dedup_key"] = item.dedup_key
+    return row
+
+
+# Aggregate rows per heatmap upsert, within the bind parameter limit
+heatmap_chunk_size = MAX_QUERY_PARAMS // len(hazard_heatmap.c)
+
+
+async def update_hazard_heatmap(session, deltas: List[Dict[str, Any]]):
+    """
+    Add count deltas to the hazard heatmap aggregates, one upsert per chunk.
+    The chunks follow the sorted order of the deltas, so concurrent updates
+    still lock aggregate rows in the same order.
+    """
+    for start in range(0, len(deltas), heatmap_chunk_size):
+        query = pg_insert(hazard_heatmap).values(deltas[start:start + heatmap_chunk_size])
+        query = query.on_conflict_do_update(
+            index_elements=[column for column in hazard_heatmap.primary_key],
+            set_={"count": hazard_heatmap.c.count + query.excluded.count},
+        )
+        await session.execute(query)
+
+
+processed_agent_data_list = TypeAdapter(List[ProcessedAgentData])
 
 
-async def send_data_to_subscribers(data):
-    """Sending data to all subscribed clients"""
-    disconnected_clients = []
-    for websocket in subscriptions:
+async def read_processed_agent_data_rows(request: Request) -> List[Dict[str, Any]]:
+    """
+    Decode a batch body into processed_agent_data rows.
+    JSON is validated against the ProcessedAgentData model; msgpack batches of
+    flat records are decoded straight into rows. Either may be compressed with
+    gzip or zstd (Content-Encoding).
+    """
+    try:
+        content_type = check_media_type(request.headers.get("content-type", ""))
+        body = decompress(
+            await request.body(), request.headers.get("content-encoding", ""), MAX_BODY_BYTES
+        )
+    except UnsupportedTransport as e:
+        raise HTTPException(
+            status_code=415,
+            detail=f"{e}. Supported types: {', '.join(supported_media_types())}; "
+            f"encodings: {', '.join(supported_encodings())}",
+        )
+    except BodyTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid body encoding: {e}")
+
+    if content_type in MSGPACK_MEDIA_TYPES:
         try:
-            await websocket.send_json(data)
-        except WebSocketDisconnect:
-            disconnected_clients.append(websocket)
+            records = msgpack_records(body)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        return [
+            dict(record, cell=cell_id(record["latitude"], record["longitude"]))
+            for record in records
+        ]
 
-    for websocket in disconnected_clients:
-        subscriptions.remove(websocket)
+    try:
+        data = processed_agent_data_list.validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
+    return [processed_agent_data_to_row(item) for item in data]
 
 
-# FastAPI CRUDL endpoints
 @app.post("/processed_agent_data/")
-async def create_processed_agent_data(data: List[ProcessedAgentData]):
+async def create_processed_agent_data(request: Request):
     # Insert data to database
     print("Creating processed agent data...")
 
-    with SessionLocal() as session:
-        for item in data:
-            query = processed_agent_data.insert().values(
-                road_state=item.road_state,
-                x=item.agent_data.accelerometer.x,
-                y=item.agent_data.accelerometer.y,
-                z=item.agent_data.accelerometer.z,
-                latitude=item.agent_data.gps.latitude,
-                longitude=item.agent_data.gps.longitude,
-                timestamp=item.agent_data.timestamp,
+    rows = await read_processed_agent_data_rows(request)
+    if len(rows) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch is too large: {len(rows)} items, max is {MAX_BATCH_SIZE}",
+        )
+
+    inserted = []
+    async with SessionLocal() as session:
+        # One multi-row INSERT per chunk, all chunks in one transaction
+        for start in range(0, len(rows), insert_chunk_size):
+            chunk = rows[start:start + insert_chunk_size]
+            # Rows whose dedup key is already stored are skipped and not returned
+            query = (
+                pg_insert(processed_agent_data)
+                .values(chunk)
+                .on_conflict_do_nothing()
+                .returning(*processed_agent_data.c)
             )
-            session.execute(query)
+            inserted.extend((await session.execute(query)).all())
+
+        await update_hazard_heatmap(
+            session, heatmap_deltas(added=[row._mapping for row in inserted])
+        )
+        await session.commit()
+        print(f"Processed agent data was created! ({len(inserted)} rows)")
 
-        session.commit()
-        print("Processed agent data was created!")
+    # Publish the new rows to websocket subscribers
+    change_feed.publish([processed_agent_data_row_to_dict(row) for row in inserted])
+
+@app.get("/processed_agent_data/bbox",
+    response_model=list[ProcessedAgentDataInDB])
+async def list_processed_agent_data_in_bbox(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    road_state: Optional[str] = None,
+    limit: int = Query(BBOX_MAX_POINTS, ge=1, le=BBOX_MAX_POINTS),
+):
+    """
+    List the newest processed agent data inside a map viewport.
+    The indexed grid cell column narrows the scan down to the cells covering
+    the box, the exact coordinates are then checked against the box.
+    """
+    print("Listing processed agent data in bbox...")
+
+    if min_lat > max_lat or min_lon > max_lon:
+        raise HTTPException(status_code=422, detail="Invalid bounding box")
+
+    table = processed_agent_data
+    query = select(table).where(
+        or_(*(table.c.cell.between(low, high) for low, high in cell_ranges(
+            min_lat, min_lon, max_lat, max_lon
+        ))),
+        table.c.latitude.between(min_lat, max_lat),
+        table.c.longitude.between(min_lon, max_lon),
+    )
+    if road_state is not None:
+        query = query.where(table.c.road_state == road_state)
+    query = query.order_by(table.c.id.desc()).limit(limit)
+
+    async with SessionLocal() as session:
+        result = (await session.execute(query)).all()
+        print("Result: ", len(result))
+    return result
+
+
+async def stream_export(query, encoder):
+    """Encode rows read from a server-side cursor chunk by chunk"""
+    yield encoder.begin()
+    async with SessionLocal() as session:
+        result = await session.stream(
+            query.execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        async for rows in result.partitions():
+            yield encoder.encode(rows)
+    yield encoder.end()
+
+
+@app.get("/processed_agent_data/export")
+async def export_processed_agent_data(
+    start: UtcDatetime,
+    end: UtcDatetime,
+    road_state: Optional[str] = None,
+    format: Literal["arrow", "parquet", "csv"] = "arrow",
+):
+    """
+    Export the rows of a time range as an Arrow IPC stream, a Parquet file or
+    CSV. Rows are read from a server-side cursor EXPORT_CHUNK_SIZE rows at a
+    time and every chunk is encoded as one record batch / row group.
+    Without pyarrow installed the export is always CSV.
+    """
+    print("Exporting processed agent data...")
+
+    encoder = make_encoder(format, processed_agent_data)
+    query = select(processed_agent_data).where(
+        *processed_agent_data_conditions(road_state, start, end)
+    ).order_by(processed_agent_data.c.timestamp, processed_agent_data.c.id)
+    filename = f"processed_agent_data_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}.{encoder.extension}"
+    return StreamingResponse(
+        stream_export(query, encoder),
+        media_type=encoder.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
-    # Send data to subscribers
-    await send_data_to_subscribers(data)
 
 @app.get("/processed_agent_data/{processed_agent_data_id}",
     response_model=ProcessedAgentDataInDB)
-def read_processed_agent_data(processed_agent_data_id: int):
+async def read_processed_agent_data(processed_agent_data_id: int):
     # Get data by id
     print("Reading processed agent data by id...")
 
-    with SessionLocal() as session:
+    async with SessionLocal() as session:
         # print(processed_agent_data_id)
         query = select(processed_agent_data).where(
             processed_agent_data.c.id == processed_agent_data_id
         )
 
-        result = session.execute(query).first()
+        result = (await session.execute(query)).first()
         print("Result: ", result)
 
         if result is None:
@@ -151,90 +405,367 @@ def read_processed_agent_data(processed_agent_data_id: int):
 
         return result
 
+
+
+def processed_agent_data_conditions(
+    road_state: Optional[str],
+    start: Optional[datetime],
+    end: Optional[datetime],
+) -> List[Any]:
+    """Build the WHERE conditions of the road_state and time range filters"""
+    table = processed_agent_data
+    conditions = []
+    if road_state is not None:
+        conditions.append(table.c.road_state == road_state)
+    if start is not None:
+        conditions.append(table.c.timestamp >= start)
+    if end is not None:
+        conditions.append(table.c.timestamp < end)
+    return conditions
+
+
+def filter_processed_agent_data(
+    query,
+    order_by: str,
+    after_id: Optional[int],
+    after_timestamp: Optional[datetime],
+    road_state: Optional[str],
+    start: Optional[datetime],
+    end: Optional[datetime],
+):
+    """Apply keyset cursor, filters and a stable ordering to a select()"""
+    table = processed_agent_data
+    query = query.where(*processed_agent_data_conditions(road_state, start, end))
+
+    if order_by == "timestamp":
+        if after_timestamp is not None and after_id is not None:
+            query = query.where(
+                tuple_(table.c.timestamp, table.c.id) > tuple_(after_timestamp, after_id)
+            )
+        elif after_timestamp is not None:
+            query = query.where(table.c.timestamp > after_timestamp)
+        return query.order_by(table.c.timestamp, table.c.id)
+
+    if after_id is not None:
+        query = query.where(table.c.id > after_id)
+    return query.order_by(table.c.id)
+
+
+async def stream_processed_agent_data(query):
+    """Yield NDJSON lines from a server-side cursor, one chunk at a time"""
+    async with SessionLocal() as session:
+        result = await session.stream(
+            query.execution_options(yield_per=STREAM_CHUNK_SIZE)
+        )
+        async for rows in result.partitions():
+            yield "".join(
+                processed_agent_data_row_to_json(row) + "\n" for row in rows
+            )
+
+
 @app.get("/processed_agent_data/",
     response_model=list[ProcessedAgentDataInDB])
-def list_processed_agent_data():
-    # Get list of data
+async def list_processed_agent_data(
+    response: Response,
+    after_id: Optional[int] = None,
+    after_timestamp: Optional[UtcDatetime] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    road_state: Optional[str] = None,
+    start: Optional[UtcDatetime] = None,
+    end: Optional[UtcDatetime] = None,
+    order_by: Literal["id", "timestamp"] = "id",
+    format: Literal["json", "ndjson"] = "json",
+):
+    """
+    List processed agent data page by page.
+    Pages are keyset-paginated: pass the id (and the timestamp when ordering
+    by timestamp) of the last row of the previous page as after_id /
+    after_timestamp. The cursor of the next page is returned in the
+    X-Next-After-Id / X-Next-After-Timestamp headers. With format=ndjson the
+    rows are streamed from a server-side cursor and limit is optional.
+    """
     print("Listing processed agent data...")
 
-    with SessionLocal() as session:
-        query = select(processed_agent_data)
+    if order_by == "timestamp" and after_id is not None and after_timestamp is None:
+        raise HTTPException(
+            status_code=422,
+            detail="after_timestamp is required to page by timestamp",
+        )
 
-        result = session.execute(query)
-        print("Result: ", result)
+    query = filter_processed_agent_data(
+        select(processed_agent_data),
+        order_by,
+        after_id,
+        after_timestamp,
+        road_state,
+        start,
+        end,
+    )
+
+    if format == "ndjson":
+        if limit is not None:
+            query = query.limit(limit)
+        return StreamingResponse(
+            stream_processed_agent_data(query),
+            media_type="application/x-ndjson",
+        )
 
-        if result is None:
-            print("Data not found")
-            raise HTTPException(status_code=404, detail="Data not found")
+    query = query.limit(min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    async with SessionLocal() as session:
+        result = (await session.execute(query)).all()
+        print("Result: ", len(result))
+
+    if result:
+        response.headers["X-Next-After-Id"] = str(result[-1].id)
+        if order_by == "timestamp":
+            response.headers["X-Next-After-Timestamp"] = result[-1].timestamp.isoformat()
+    return result
+
+# Snapshot of the rows before an UPDATE, joined in its FROM clause so that
+# RETURNING can report the old values next to the new ones
+processed_agent_data_old = processed_agent_data.alias("old")
+
+
+def old_values_columns() -> List[Any]:
+    """Old road_state, coordinates and timestamp of updated rows, for RETURNING"""
+    old = processed_agent_data_old
+    return [
+        old.c.road_state.label("old_road_state"),
+        old.c.latitude.label("old_latitude"),
+        old.c.longitude.label("old_longitude"),
+        old.c.timestamp.label("old_timestamp"),
+    ]
+
+
+def old_values(row) -> Dict[str, Any]:
+    return {
+        "road_state": row.old_road_state,
+        "latitude": row.old_latitude,
+        "longitude": row.old_longitude,
+        "timestamp": row.old_timestamp,
+    }
+
+
+def batch_conditions(ids: Optional[List[int]], filter: Optional[ProcessedAgentDataFilter]) -> List[Any]:
+    """
+    WHERE conditions selecting the rows of a batch update or delete.
+    A filter alone selects at most MAX_BATCH_SIZE + 1 rows, so a filter
+    matching too many rows is caught by check_batch_size without the
+    statement touching (and returning) all of them.
+    """
+    if ids is None and filter is None:
+        raise HTTPException(status_code=422, detail="Either ids or filter is required")
+    if ids is not None and len(ids) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch is too large: {len(ids)} ids, max is {MAX_BATCH_SIZE}",
+        )
+    table = processed_agent_data
+    conditions = []
+    if ids is not None:
+        conditions.append(table.c.id.in_(ids))
+    if filter is not None:
+        conditions.extend(
+            processed_agent_data_conditions(filter.road_state, filter.start, filter.end)
+        )
+    # An empty filter would select the whole table
+    if not conditions:
+        raise HTTPException(
+            status_code=422, detail="filter requires at least one of road_state, start or end"
+        )
+    if ids is None:
+        selected = (
+            select(table.c.id, table.c.timestamp)
+            .where(*conditions)
+            .limit(MAX_BATCH_SIZE + 1)
+            .correlate(None)
+        )
+        conditions = [tuple_(table.c.id, table.c.timestamp).in_(selected)]
+    return conditions
+
+
+def check_batch_size(count: int):
+    """Reject a batch whose filter matched more than MAX_BATCH_SIZE rows"""
+    if count > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch is too large: filter matches more than {MAX_BATCH_SIZE} rows",
+        )
+
+
+@app.put(
+    "/processed_agent_data/batch",
+    response_model=ProcessedAgentDataBatchResult)
+async def update_processed_agent_data_batch(data: ProcessedAgentDataBatchUpdate):
+    """Relabel the road_state of every selected row with one UPDATE ... RETURNING"""
+    print("Updating processed agent data batch...")
+
+    table = processed_agent_data
+    old = processed_agent_data_old
+    query = update(table).where(
+        *batch_conditions(data.ids, data.filter),
+        old.c.id == table.c.id,
+        old.c.timestamp == table.c.timestamp,
+    ).values(road_state=data.road_state).returning(*table.c, *old_values_columns())
+
+    async with SessionLocal() as session:
+        result = (await session.execute(query)).all()
+        # Raising rolls the update back
+        check_batch_size(len(result))
+        await update_hazard_heatmap(session, heatmap_deltas(
+            added=[row._mapping for row in result],
+            removed=[old_values(row) for row in result],
+        ))
+        await session.commit()
+
+    print(f"{len(result)} rows were updated!")
+    return ProcessedAgentDataBatchResult(count=len(result), ids=[row.id for row in result])
+
+
+@app.delete(
+    "/processed_agent_data/batch",
+    response_model=ProcessedAgentDataBatchResult)
+async def delete_processed_agent_data_batch(data: ProcessedAgentDataBatchDelete):
+    """Delete every selected row with one DELETE ... RETURNING"""
+    print("Deleting processed agent data batch...")
+
+    query = delete(processed_agent_data).where(
+        *batch_conditions(data.ids, data.filter)
+    ).returning(*processed_agent_data.c)
+
+    async with SessionLocal() as session:
+        result = (await session.execute(query)).all()
+        # Raising rolls the delete back
+        check_batch_size(len(result))
+        await update_hazard_heatmap(
+            session, heatmap_deltas(removed=[row._mapping for row in result])
+        )
+        await session.commit()
+
+    print(f"{len(result)} rows were deleted!")
+    return ProcessedAgentDataBatchResult(count=len(result), ids=[row.id for row in result])
 
-        return result
 
 @app.put(
     "/processed_agent_data/{processed_agent_data_id}",
     response_model=ProcessedAgentDataInDB)
-def update_processed_agent_data(processed_agent_data_id: int, data: ProcessedAgentData):
+async def update_processed_agent_data(processed_agent_data_id: int, data: ProcessedAgentData):
     # Update data
     print("Updating processed agent data by id...")
 
-    with SessionLocal() as session:
-        query = select(processed_agent_data).where(
-            processed_agent_data.c.id == processed_agent_data_id)
-
-        result = session.execute(query).first()
+    table = processed_agent_data
+    old = processed_agent_data_old
+    query = update(table).where(
+        table.c.id == processed_agent_data_id,
+        old.c.id == table.c.id,
+        old.c.timestamp == table.c.timestamp,
+    ).values(
+        # The dedup key identifies the original reading and is kept
+        **processed_agent_data_to_row(data, dedup_key=False)
+    ).returning(*table.c, *old_values_columns())
+
+    async with SessionLocal() as session:
+        result = (await session.execute(query)).first()
         print("Result: ", result)
 
         if result is None:
             print("Data not found")
             raise HTTPException(status_code=404, detail="Data not found")
 
-        query = update(processed_agent_data).where(
-            processed_agent_data.c.id == processed_agent_data_id
-        ).values(
-            road_state=data.road_state,
-            x=data.agent_data.accelerometer.x,
-            y=data.agent_data.accelerometer.y,
-            z=data.agent_data.accelerometer.z,
-            latitude=data.agent_data.gps.latitude,
-            longitude=data.agent_data.gps.longitude,
-            timestamp=data.agent_data.timestamp,
-        )
-
-        session.execute(query)
-        session.commit()
-
-        query = select(processed_agent_data).where(
-            processed_agent_data.c.id == processed_agent_data_id)
-        result = session.execute(query).first()
-        print("Result: ", result)
+        await update_hazard_heatmap(session, heatmap_deltas(
+            added=[result._mapping], removed=[old_values(result)]
+        ))
+        await session.commit()
 
         return result
 
 
 @app.delete("/processed_agent_data/{processed_agent_data_id}",
     response_model=ProcessedAgentDataInDB)
-def delete_processed_agent_data(processed_agent_data_id: int):
+async def delete_processed_agent_data(processed_agent_data_id: int):
     # Delete by id
     print("Deleting processed_agent_data by id...")
 
-    with SessionLocal() as session:
-        query = select(processed_agent_data).where(
-            processed_agent_data.c.id == processed_agent_data_id)
-        result = session.execute(query).first()
+    query = delete(processed_agent_data).where(
+        processed_agent_data.c.id == processed_agent_data_id
+    ).returning(*processed_agent_data.c)
+
+    async with SessionLocal() as session:
+        result = (await session.execute(query)).first()
         print("Result: ", result)
 
         if result is None:
             print("Data not found")
             raise HTTPException(status_code=404, detail="Data not found")
 
-        query = delete(processed_agent_data).where(
-            processed_agent_data.c.id == processed_agent_data_id
+        await update_hazard_heatmap(
+            session, heatmap_deltas(removed=[result._mapping])
         )
-
-        session.execute(query)
-        session.commit()
+        await session.commit()
         print(f"{processed_agent_data_id} was deleted!")
         return result
 
+
+@app.get("/heatmap/{z}/{x}/{y}", response_model=list[HazardHeatmapCell])
+async def read_hazard_heatmap_tile(
+    z: int,
+    x: int,
+    y: int,
+    road_state: Optional[str] = None,
+    start: Optional[UtcDatetime] = None,
+    end: Optional[UtcDatetime] = None,
+):
+    """
+    Return hazard counts for a web map tile.
+    The counts come from the aggregates kept at the closest maintained zoom
+    level (HEATMAP_ZOOMS) at or above z, so a tile is split into finer cells
+    when possible.
+    """
+    print("Reading hazard heatmap tile...")
+
+    if not (0 <= z <= 30 and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise HTTPException(status_code=422, detail="Invalid tile coordinates")
+
+    level = heatmap_level(z)
+    min_x, max_x, min_y, max_y = tile_range(x, y, z, level)
+    table = hazard_heatmap
+    query = select(
+        table.c.tile_x,
+        table.c.tile_y,
+        table.c.road_state,
+        func.sum(table.c.count).label("count"),
+    ).where(
+        table.c.zoom == level,
+        table.c.tile_x.between(min_x, max_x),
+        table.c.tile_y.between(min_y, max_y),
+    )
+    if road_state is not None:
+        query = query.where(table.c.road_state == road_state)
+    if start is not None:
+        query = query.where(table.c.bucket >= start)
+    if end is not None:
+        query = query.where(table.c.bucket < end)
+    query = query.group_by(table.c.tile_x, table.c.tile_y, table.c.road_state)
+
+    async with SessionLocal() as session:
+        result = (await session.execute(query)).all()
+
+    cells = []
+    for tile_x, tile_y, cell_road_state, count in result:
+        if count <= 0:
+            continue
+        latitude, longitude = tile_center(tile_x, tile_y, level)
+        cells.append(HazardHeatmapCell(
+            zoom=level,
+            x=tile_x,
+            y=tile_y,
+            latitude=latitude,
+            longitude=longitude,
+            road_state=cell_road_state,
+            count=count,
+        ))
+    return cells
+
 # if __name__ == "__main__":
 #     uvicorn.run(app, host="127.0.0.1", port=8000)
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 # Database model
 from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel
 
 
@@ -12,3 +13,14 @@ class ProcessedAgentDataInDB(BaseModel):
     latitude: float
     longitude: float
     timestamp: datetime
+    dedup_key: Optional[str] = None
+
+
+class HazardHeatmapCell(BaseModel):
+    zoom: int
+    x: int
+    y: int
+    latitude: float
+    longitude: float
+    road_state: str
+    count: int
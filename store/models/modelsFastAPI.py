@@ -1,6 +1,22 @@
 # FastAPI models
-from datetime import datetime
-from pydantic import BaseModel, field_validator
+from datetime import datetime, timezone
+from typing import Annotated, List, Optional
+from pydantic import AfterValidator, BaseModel, field_validator
+
+
+def to_naive_utc(value: datetime) -> datetime:
+    """
+    Convert an aware datetime to naive UTC, the timestamp columns are
+    TIMESTAMP WITHOUT TIME ZONE and asyncpg only encodes naive values there.
+    Naive datetimes are taken as UTC already.
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# datetime accepted with or without an offset, stored as naive UTC
+UtcDatetime = Annotated[datetime, AfterValidator(to_naive_utc)]
 
 # FastAPI models
 class AccelerometerData(BaseModel):
@@ -15,7 +31,7 @@ class GpsData(BaseModel):
 class AgentData(BaseModel):
     accelerometer: AccelerometerData
     gps: GpsData
-    timestamp: datetime
+    timestamp: UtcDatetime
 
     @classmethod
     @field_validator('timestamp', mode='before')
@@ -30,3 +46,22 @@ class AgentData(BaseModel):
 class ProcessedAgentData(BaseModel):
     road_state: str
     agent_data: AgentData
+    dedup_key: Optional[str] = None
+
+class ProcessedAgentDataFilter(BaseModel):
+    road_state: Optional[str] = None
+    start: Optional[UtcDatetime] = None
+    end: Optional[UtcDatetime] = None
+
+class ProcessedAgentDataBatchUpdate(BaseModel):
+    ids: Optional[List[int]] = None
+    filter: Optional[ProcessedAgentDataFilter] = None
+    road_state: str
+
+class ProcessedAgentDataBatchDelete(BaseModel):
+    ids: Optional[List[int]] = None
+    filter: Optional[ProcessedAgentDataFilter] = None
+
+class ProcessedAgentDataBatchResult(BaseModel):
+    count: int
+    ids: List[int]
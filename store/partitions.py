@@ -0,0 +1,200 @@
+import asyncio
+import re
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from config import (
+    HEATMAP_BUCKET_SECONDS,
+    PARTITION_PREMAKE_DAYS,
+    RETENTION_DAYS,
+    RETENTION_MODE,
+    PARTITION_MAINTENANCE_INTERVAL,
+)
+
+RETENTION_MODES = ("drop", "detach")
+
+
+def partition_name(table_name: str, day: date) -> str:
+    return f"{table_name}_p{day:%Y%m%d}"
+
+
+async def is_partitioned(conn, table_name: str) -> bool:
+    result = await conn.execute(
+        text(
+            "SELECT 1 FROM pg_partitioned_table pt "
+            "JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = :table_name"
+        ),
+        {"table_name": table_name},
+    )
+    return result.first() is not None
+
+
+async def list_daily_partitions(conn, table_name: str) -> List[date]:
+    """Return the days of the daily partitions attached to the table"""
+    result = await conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table_name"
+        ),
+        {"table_name": table_name},
+    )
+    pattern = re.compile(rf"^{re.escape(table_name)}_p(\d{{8}})$")
+    days = []
+    for (name,) in result:
+        match = pattern.match(name)
+        if match:
+            days.append(datetime.strptime(match.group(1), "%Y%m%d").date())
+    return sorted(days)
+
+
+def default_partition_name(table_name: str) -> str:
+    return f"{table_name}_default"
+
+
+async def default_partition_days(conn, table_name: str) -> List[date]:
+    """Return the days of the rows that landed in the default partition"""
+    result = await conn.execute(
+        text(
+            f"SELECT DISTINCT CAST(timestamp AS date) "
+            f"FROM {default_partition_name(table_name)} ORDER BY 1"
+        )
+    )
+    return [day for (day,) in result]
+
+
+async def create_partition(engine: AsyncEngine, table_name: str, day: date):
+    """
+    Create the partition of one day.
+    Postgres refuses to create it while the default partition holds rows of
+    that day (device clock skew, backfill, maintenance falling behind), so
+    those rows are moved into the new partition in the same transaction.
+    """
+    name = partition_name(table_name, day)
+    default_name = default_partition_name(table_name)
+    bounds = {"start": day, "end": day + timedelta(days=1)}
+    values = f"FOR VALUES FROM ('{bounds['start'].isoformat()}') TO ('{bounds['end'].isoformat()}')"
+    async with engine.begin() as conn:
+        if (await conn.execute(text("SELECT to_regclass(:name)"), {"name": name})).scalar() is not None:
+            return
+        # Writes to the default partition wait until the rows are moved
+        await conn.execute(text(f"LOCK TABLE {default_name} IN EXCLUSIVE MODE"))
+        misplaced = (await conn.execute(
+            text(
+                f"SELECT count(*) FROM {default_name} "
+                f"WHERE timestamp >= :start AND timestamp < :end"
+            ),
+            bounds,
+        )).scalar()
+        if not misplaced:
+            await conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table_name} {values}"))
+            return
+        await conn.execute(
+            text(f"CREATE TABLE {name} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        )
+        await conn.execute(
+            text(
+                f"WITH moved AS ("
+                f"DELETE FROM {default_name} "
+                f"WHERE timestamp >= :start AND timestamp < :end RETURNING *"
+                f") INSERT INTO {name} SELECT * FROM moved"
+            ),
+            bounds,
+        )
+        await conn.execute(text(f"ALTER TABLE {table_name} ATTACH PARTITION {name} {values}"))
+    print(f"Moved {misplaced} rows of {day} from {default_name} into partition {name}")
+
+
+async def create_partitions(engine: AsyncEngine, table_name: str, today: date):
+    """
+    Create the default partition, daily partitions up to PARTITION_PREMAKE_DAYS
+    ahead and the partitions of every day with rows in the default partition,
+    so those rows are covered by retention too.
+    """
+    async with engine.begin() as conn:
+        await conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {default_partition_name(table_name)} "
+                f"PARTITION OF {table_name} DEFAULT"
+            )
+        )
+        days = set(await default_partition_days(conn, table_name))
+    days.update(today + timedelta(days=offset) for offset in range(PARTITION_PREMAKE_DAYS + 1))
+    for day in sorted(days):
+        try:
+            # One transaction per partition, so one failing day does not
+            # prevent the others from being created
+            await create_partition(engine, table_name, day)
+        except Exception as e:
+            print(f"Failed to create partition of {table_name} for {day}: {e}")
+
+
+async def apply_retention(
+    engine: AsyncEngine, table_name: str, today: date, heatmap_table_name: Optional[str] = None
+):
+    """
+    Drop or detach the daily partitions older than RETENTION_DAYS, and delete
+    the heatmap buckets that end before the oldest day kept, since their rows
+    are gone.
+    """
+    if RETENTION_DAYS <= 0:
+        return
+    if RETENTION_MODE not in RETENTION_MODES:
+        print(f"Unknown retention mode {RETENTION_MODE!r}, expected one of {RETENTION_MODES}")
+        return
+    cutoff = today - timedelta(days=RETENTION_DAYS)
+    async with engine.connect() as conn:
+        days = await list_daily_partitions(conn, table_name)
+    for day in days:
+        if day >= cutoff:
+            break
+        name = partition_name(table_name, day)
+        async with engine.begin() as conn:
+            if RETENTION_MODE == "detach":
+                # The detached table is kept as is, ready to be archived
+                await conn.execute(text(f"ALTER TABLE {table_name} DETACH PARTITION {name}"))
+                print(f"Partition {name} was detached by retention")
+            else:
+                await conn.execute(text(f"DROP TABLE {name}"))
+                print(f"Partition {name} was dropped by retention")
+    if heatmap_table_name is not None:
+        last_bucket = datetime.combine(cutoff, datetime.min.time()) - timedelta(
+            seconds=HEATMAP_BUCKET_SECONDS
+        )
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                text(f"DELETE FROM {heatmap_table_name} WHERE bucket <= :last_bucket"),
+                {"last_bucket": last_bucket},
+            )
+        if result.rowcount:
+            print(f"{result.rowcount} {heatmap_table_name} buckets were deleted by retention")
+
+
+async def maintain_partitions(
+    engine: AsyncEngine, table_name: str, heatmap_table_name: Optional[str] = None
+):
+    """Create upcoming daily partitions and apply retention to old ones"""
+    async with engine.connect() as conn:
+        if not await is_partitioned(conn, table_name):
+            print(f"{table_name} is not partitioned, skipping partition maintenance")
+            return
+    today = datetime.now().date()
+    await create_partitions(engine, table_name, today)
+    await apply_retention(engine, table_name, today, heatmap_table_name)
+
+
+async def run_partition_maintenance(
+    engine: AsyncEngine, table_name: str, heatmap_table_name: Optional[str] = None
+):
+    """Background job running maintain_partitions every PARTITION_MAINTENANCE_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+        try:
+            await maintain_partitions(engine, table_name, heatmap_table_name)
+        except Exception as e:
+            print(f"Partition maintenance failed: {e}")
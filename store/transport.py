@@ -0,0 +1,104 @@
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List
+
+from models.modelsFastAPI import to_naive_utc
+
+try:
+    import msgpack
+except ImportError:  # msgpack bodies are answered with 415
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # zstd bodies are answered with 415
+    zstandard = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# Order of the fields in a msgpack record; the hub packs a batch as a list of such lists.
+# The trailing dedup_key is optional
+MSGPACK_FIELDS = ("road_state", "x", "y", "z", "latitude", "longitude", "timestamp", "dedup_key")
+
+
+class UnsupportedTransport(Exception):
+    """The body uses a media type or encoding this store cannot decode"""
+
+
+class BodyTooLarge(Exception):
+    """The decompressed body is larger than allowed"""
+
+
+def media_type(content_type: str) -> str:
+    return content_type.split(";")[0].strip().lower() or JSON_MEDIA_TYPE
+
+
+def supported_media_types() -> List[str]:
+    return [JSON_MEDIA_TYPE] + (list(MSGPACK_MEDIA_TYPES) if msgpack is not None else [])
+
+
+def supported_encodings() -> List[str]:
+    return ["identity", "gzip"] + (["zstd"] if zstandard is not None else [])
+
+
+def check_media_type(content_type: str) -> str:
+    """Return the media type of the body, raise UnsupportedTransport if it cannot be decoded"""
+    value = media_type(content_type)
+    if value not in supported_media_types():
+        raise UnsupportedTransport(f"Unsupported Content-Type {value}")
+    return value
+
+
+def decompress(body: bytes, content_encoding: str, max_size: int) -> bytes:
+    """Undo the Content-Encoding of the body without inflating more than max_size bytes"""
+    encoding = content_encoding.strip().lower() or "identity"
+    if encoding == "identity":
+        data = body
+    elif encoding == "gzip":
+        decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        data = decompressor.decompress(body, max_size + 1)
+    elif encoding == "zstd" and zstandard is not None:
+        with zstandard.ZstdDecompressor().stream_reader(body) as reader:
+            data = reader.read(max_size + 1)
+    else:
+        raise UnsupportedTransport(f"Unsupported Content-Encoding {encoding}")
+    if len(data) > max_size:
+        raise BodyTooLarge(f"Body is larger than {max_size} bytes")
+    return data
+
+
+def msgpack_records(body: bytes) -> List[Dict[str, Any]]:
+    """
+    Decode a msgpack batch straight into processed_agent_data column values.
+    Raises ValueError if a record does not have the expected fields and types.
+    """
+    try:
+        records = msgpack.unpackb(body, use_list=False)
+    except Exception as e:
+        raise ValueError(f"Invalid msgpack body: {e}")
+    if not isinstance(records, (list, tuple)):
+        raise ValueError("Expected a msgpack array of records")
+    rows = []
+    for index, record in enumerate(records):
+        try:
+            if len(record) == len(MSGPACK_FIELDS) - 1:
+                record = (*record, None)
+            road_state, x, y, z, latitude, longitude, timestamp, dedup_key = record
+            if not isinstance(road_state, str):
+                raise TypeError("road_state is not a string")
+            if dedup_key is not None and not isinstance(dedup_key, str):
+                raise TypeError("dedup_key is not a string")
+            rows.append({
+                "road_state": road_state,
+                "x": float(x),
+                "y": float(y),
+                "z": float(z),
+                "latitude": float(latitude),
+                "longitude": float(longitude),
+                "timestamp": to_naive_utc(datetime.fromisoformat(timestamp)),
+                "dedup_key": dedup_key,
+            })
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid record {index}: {e}")
+    return rows